@@ -0,0 +1,321 @@
+import numpy as np
+from numba import njit
+
+from g6_reader import numpy_adjmatrix_to_g6_bytes
+
+
+@njit
+def refine_colouring(M, colours):
+    """
+    Colour refinement: repeatedly splits the colour classes by the number of neighbours a vertex has in each class,
+    until the colouring is stable. New colours are ranks of (old colour, neighbour colour counts) signatures, so the
+    result does not depend on the vertex labelling and refines the input colouring.
+    :param M: adjacency matrix of graph G
+    :param colours: np.array of initial colours in 0..n-1, e.g. all zeros
+    :return: np.array of stable colours in 0..n-1
+    """
+    n = M.shape[0]
+    colours = colours.copy()
+    num_colours = len(np.unique(colours))
+    order = np.arange(n)
+    while True:
+        signatures = np.zeros((n, n + 1), dtype=np.int64)
+        for v in range(n):
+            signatures[v, 0] = colours[v]
+            for u in range(n):
+                if M[v, u]:
+                    signatures[v, 1 + colours[u]] += 1
+        # the new colour of v is the number of distinct signatures lexicographically smaller than that of v: sort the
+        # vertices by signature (insertion sort, n is small) and count the steps up along the sorted order
+        for i in range(1, n):
+            v = order[i]
+            j = i
+            while j > 0 and _lex_less(signatures[v], signatures[order[j - 1]]):
+                order[j] = order[j - 1]
+                j -= 1
+            order[j] = v
+        new_colours = np.zeros(n, dtype=np.int64)
+        for i in range(1, n):
+            previous, v = order[i - 1], order[i]
+            new_colours[v] = new_colours[previous] + _lex_less(signatures[previous], signatures[v])
+        new_num_colours = new_colours[order[n - 1]] + 1
+        colours = new_colours
+        if new_num_colours == num_colours:
+            return colours
+        num_colours = new_num_colours
+
+
+@njit
+def _lex_less(x, y):
+    for i in range(x.shape[0]):
+        if x[i] != y[i]:
+            return x[i] < y[i]
+    return False
+
+
+@njit
+def automorphism_group(M):
+    """
+    Lists every automorphism of G by backtracking: vertices 0, 1, ... are mapped in turn to unused vertices of the same
+    refined colour, keeping adjacency to the vertices already mapped. The whole group is returned explicitly, which is
+    fine for the graph sizes considered here (at worst n! rows, for the complete graph).
+    :param M: adjacency matrix of graph G
+    :return: np.array of shape (|Aut(G)|, n), each row sigma an automorphism mapping vertex v to sigma[v]
+    """
+    n = M.shape[0]
+    colours = refine_colouring(M, np.zeros(n, dtype=np.int64))
+    autos = []
+    image = np.zeros(n, dtype=np.uint8)
+    used = np.zeros(n, dtype=np.bool_)
+    next_candidate = np.zeros(n + 1, dtype=np.int64)
+    v = 0
+    while v >= 0:
+        if v == n:
+            autos.append(image.copy())
+            v -= 1
+            used[image[v]] = False
+            continue
+        w = next_candidate[v]
+        if w == n:
+            next_candidate[v] = 0
+            v -= 1
+            if v >= 0:
+                used[image[v]] = False
+            continue
+        next_candidate[v] = w + 1
+        if used[w] or colours[w] != colours[v]:
+            continue
+        consistent = True
+        for u in range(v):
+            if M[v, u] != M[w, image[u]]:
+                consistent = False
+                break
+        if not consistent:
+            continue
+        image[v] = w
+        used[w] = True
+        v += 1
+    out = np.empty((len(autos), n), dtype=np.uint8)
+    for i in range(len(autos)):
+        out[i] = autos[i]
+    return out
+
+
+@njit
+def is_orbit_representative(word, autos):
+    """
+    :param word: a permutation of 0..n-1
+    :param autos: np.array of shape (k, n) listing the whole automorphism group
+    :return: True if word is the lexicographically smallest word in its orbit, i.e. one that
+     orbit_representative_generator steps through
+    """
+    n = word.shape[0]
+    for a in range(autos.shape[0]):
+        for i in range(n):
+            image = autos[a, word[i]]
+            if image != word[i]:
+                if image < word[i]:
+                    return False
+                break
+    return True
+
+
+@njit
+def _individualize(colours, v):
+    """
+    :return: colours with v split off into a colour of its own, just below the rest of its class, as ranks 0..n-1
+    """
+    n = colours.shape[0]
+    doubled = 2 * colours + 1
+    doubled[v] -= 1
+    ranks = np.zeros(n, dtype=np.int64)
+    for u in range(n):
+        for w in range(n):
+            if doubled[w] < doubled[u] and _first_value(doubled, w):
+                ranks[u] += 1
+    return ranks
+
+
+@njit
+def _first_value(values, w):
+    for u in range(w):
+        if values[u] == values[w]:
+            return False
+    return True
+
+
+@njit
+def _find(parent, u):
+    while parent[u] != u:
+        parent[u] = parent[parent[u]]
+        u = parent[u]
+    return u
+
+
+@njit
+def _orbit_roots(generators, fixed, num_fixed, n):
+    """
+    :return: np.array giving each vertex the smallest vertex of its orbit under the group generated by those of
+     generators which fix each of fixed[:num_fixed]
+    """
+    parent = np.arange(n)
+    for gen in generators:
+        fixes = True
+        for i in range(num_fixed):
+            if gen[fixed[i]] != fixed[i]:
+                fixes = False
+                break
+        if not fixes:
+            continue
+        for u in range(n):
+            a = _find(parent, u)
+            b = _find(parent, gen[u])
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+    for u in range(n):
+        parent[u] = _find(parent, u)
+    return parent
+
+
+@njit
+def _leaf_automorphism(colours, other):
+    """
+    :return: the automorphism taking the leaf labelled by colours to the leaf labelled by other, whose codes are equal
+    """
+    n = colours.shape[0]
+    vertex_of = np.empty(n, dtype=np.int64)
+    for u in range(n):
+        vertex_of[other[u]] = u
+    gen = np.empty(n, dtype=np.uint8)
+    for u in range(n):
+        gen[u] = vertex_of[colours[u]]
+    return gen
+
+
+@njit
+def canonical_labelling(M):
+    """
+    Individualization-refinement: from the refined colouring, repeatedly individualizes each vertex of the first
+    colour class with more than one vertex and refines again, until every colour class is a single vertex. Each such
+    leaf is a labelling, and the one giving the lexicographically largest relabelled adjacency matrix is chosen, so
+    isomorphic graphs get the same relabelled matrix.
+    The automorphism group is never listed: as in nauty, two leaves with equal matrices give an automorphism, and only
+    the automorphisms found so far are used to prune. At each node only one vertex per orbit of those fixing the
+    vertices individualized so far is tried, and a leaf equivalent to the first leaf sends the search straight back to
+    where its path left the first path, as the rest of that subtree is the image of one already searched. The
+    automorphisms found generate Aut(G), and the leaves searched grow with their number rather than with |Aut(G)|.
+    :param M: adjacency matrix of graph G
+    :return: (labelling, generators): np.array labelling, such that C[labelling[u], labelling[v]] = M[u, v] is the
+     canonical form of G, and np.array of shape (k, n), automorphisms of G which generate Aut(G) (see orbits)
+    """
+    n = M.shape[0]
+    colourings = np.empty((n + 1, n), dtype=np.int64)
+    colourings[0] = refine_colouring(M, np.zeros(n, dtype=np.int64))
+    path = np.zeros(n, dtype=np.int64)
+    first_path = np.zeros(n, dtype=np.int64)
+    next_candidate = np.zeros(n + 1, dtype=np.int64)
+    tried = np.zeros((n + 1, n), dtype=np.bool_)
+    first_code = np.zeros(n * n, dtype=np.uint8)
+    first_labelling = np.arange(n, dtype=np.int64)
+    best_code = np.zeros(n * n, dtype=np.uint8)
+    best_labelling = np.arange(n, dtype=np.int64)
+    code = np.empty(n * n, dtype=np.uint8)
+    generators = [np.arange(n, dtype=np.uint8)]
+    have_first = False
+    depth = 0
+    while depth >= 0:
+        colours = colourings[depth]
+        if colours.max() == n - 1:
+            # discrete colouring, i.e. a labelling
+            for u in range(n):
+                for v in range(n):
+                    code[colours[u] * n + colours[v]] = M[u, v]
+            if not have_first:
+                first_code[:] = code
+                first_labelling[:] = colours
+                first_path[:depth] = path[:depth]
+                best_code[:] = code
+                best_labelling[:] = colours
+                have_first = True
+                depth -= 1
+            elif np.all(code == first_code):
+                generators.append(_leaf_automorphism(colours, first_labelling))
+                # the subtree where this path leaves the first path is the image of the one the first path went into
+                j = 0
+                while j < depth and path[j] == first_path[j]:
+                    j += 1
+                depth = j
+            else:
+                if np.all(code == best_code):
+                    generators.append(_leaf_automorphism(colours, best_labelling))
+                elif _lex_less(best_code, code):
+                    best_code[:] = code
+                    best_labelling[:] = colours
+                depth -= 1
+            continue
+        # the first colour class with more than one vertex
+        counts = np.zeros(n, dtype=np.int64)
+        for u in range(n):
+            counts[colours[u]] += 1
+        target = 0
+        while counts[target] < 2:
+            target += 1
+        roots = _orbit_roots(generators, path, depth, n)
+        v = next_candidate[depth]
+        while v < n:
+            if colours[v] == target:
+                new_orbit = True
+                for w in range(n):
+                    if tried[depth, w] and roots[w] == roots[v]:
+                        new_orbit = False
+                        break
+                if new_orbit:
+                    break
+            v += 1
+        if v == n:
+            depth -= 1
+            continue
+        next_candidate[depth] = v + 1
+        tried[depth, v] = True
+        path[depth] = v
+        colourings[depth + 1] = refine_colouring(M, _individualize(colours, v))
+        next_candidate[depth + 1] = 0
+        tried[depth + 1] = False
+        depth += 1
+    out = np.empty((len(generators) - 1, n), dtype=np.uint8)
+    for i in range(1, len(generators)):
+        out[i - 1] = generators[i]
+    return best_labelling, out
+
+
+@njit
+def orbits(generators, n):
+    """
+    :param generators: np.array of shape (k, n) of automorphisms of G, e.g. from canonical_labelling
+    :param n: number of vertices
+    :return: np.array giving each vertex the smallest vertex of its orbit under the group they generate
+    """
+    return _orbit_roots(generators, np.zeros(0, dtype=np.int64), 0, n)
+
+
+@njit
+def canonical_form(M):
+    """
+    :param M: adjacency matrix of graph G
+    :return: (C, labelling), the canonical form of G and the labelling taking G to it (see canonical_labelling)
+    """
+    n = M.shape[0]
+    labelling = canonical_labelling(M)[0]
+    C = np.zeros((n, n), dtype=np.uint8)
+    for u in range(n):
+        for v in range(n):
+            C[labelling[u], labelling[v]] = M[u, v]
+    return C, labelling
+
+
+def canonical_graph6(M):
+    """
+    :param M: adjacency matrix of graph G
+    :return: the graph6 encoding of the canonical form of G as bytes, the same for all graphs isomorphic to G
+    """
+    return numpy_adjmatrix_to_g6_bytes(canonical_form(M)[0])
@@ -16,6 +16,8 @@ DKutner: changed to specifically read nauty/geng outputs into a large
    where easily feasible.
 """
 
+import os
+
 import networkx as nx
 import numpy as np
 from matplotlib import pyplot as plt
@@ -39,10 +41,129 @@ def bits(data):
             yield (d >> i) & 1
 
 
+def graph6_line_offsets(path, block=1 << 28):
+    """
+    Maps graph index to byte offset for a graph6 file whose lines are not all the same width (e.g. with a >>graph6<<
+    header or CRLF line ends), so that graphs can be fetched without scanning the file. The offsets are kept in a
+    sidecar file {path}.idx.npy, built with one vectorized scan for newlines the first time (or when the graph6 file
+    has changed since) and memory-mapped afterwards.
+    :param path: path for a graph6 file
+    :param block: how many bytes are scanned at once
+    :return: np.array of num_graphs + 1 np.int64 offsets: where each graph starts, then the size of the file
+    """
+    index_path = path + ".idx.npy"
+    size = os.path.getsize(path)
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+        offsets = np.load(index_path, mmap_mode="r")
+        if offsets[-1] == size:
+            return offsets
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    starts = [np.zeros(1, dtype=np.int64)]
+    for first in range(0, size, block):
+        starts.append(np.flatnonzero(buffer[first:first + block] == ord("\n")).astype(np.int64) + first + 1)
+    offsets = np.concatenate(starts)
+    if offsets[-1] != size:
+        # no newline after the last graph
+        offsets = np.append(offsets, size)
+    if size >= 10 and bytes(buffer[:10]) == b">>graph6<<":
+        offsets[0] = 10
+    temporary_path = index_path + ".part"
+    with open(temporary_path, "wb") as file:
+        np.save(file, offsets)
+    os.replace(temporary_path, index_path)
+    return offsets
+
+
+class Graph6Stack:
+    """
+    Read-only stack of the graphs in a graph6 file of equal-sized graphs (as produced by geng for fixed n), backed by a
+    memory map of the file. geng's lines have a fixed width, so the number of graphs follows from the file size and
+    graph i starts at byte i * (width + 1): opening is O(1), and graphs are only decoded when indexed. Other files of
+    equal-sized graphs are read through their line offsets instead (see graph6_line_offsets).
+    stack[i] is an adjacency matrix, stack[i:j] (or stack[array of indices]) an np.array of shape (k, n, n); fetching k
+    graphs costs O(k), wherever they are in the file.
+    Pickling only sends the path, so pool workers map the file themselves instead of receiving a copy.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        self.offsets = None
+        self.n = int(self.buffer[0]) - 63
+        self.width = graph6_line_width(self.n)
+        if not self.buffer.shape[0] % (self.width + 1):
+            self.rows = self.buffer.reshape(-1, self.width + 1)
+            # cheap sanity check; scanning every line would defeat the point of mapping the file
+            if self.rows[0, -1] == self.rows[-1, -1] == ord("\n") and self.rows[-1, 0] == self.rows[0, 0]:
+                return
+        self.offsets = graph6_line_offsets(path)
+        self.n = int(self.buffer[self.offsets[0]]) - 63
+        self.width = graph6_line_width(self.n)
+        # the line lengths, less the line ends
+        lengths = np.diff(self.offsets)
+        ends = self.offsets[1:] - 1
+        lengths -= self.buffer[ends] == ord("\n")
+        lengths -= (lengths > self.width) & (self.buffer[ends - 1] == ord("\r"))
+        if np.any(lengths != self.width):
+            raise ValueError(f"{path} does not consist of graph6 lines for graphs of the same size")
+
+    def __len__(self):
+        if self.offsets is not None:
+            return self.offsets.shape[0] - 1
+        return self.rows.shape[0]
+
+    def _rows(self, index):
+        """
+        :return: the graph6 lines of the indexed graphs, as an np.array of shape (k, at least width)
+        """
+        if self.offsets is None:
+            return self.rows[index]
+        return self.buffer[self.offsets[:-1][index][..., None] + np.arange(self.width)]
+
+    @property
+    def shape(self):
+        return len(self), self.n, self.n
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return decode_graph6_block(self._rows(index)[None], self.n)[0]
+        return decode_graph6_block(self._rows(index), self.n)
+
+    def bitmasks(self, index=slice(None)):
+        """
+        :param index: slice or np.array of indices
+        :return: np.array of shape (k, n), the neighbourhood bitmasks of the indexed graphs
+        """
+        return decode_graph6_block_bitmasks(self._rows(index), self.n)
+
+    def blocks(self, block=1 << 16):
+        """
+        :param block: how many graphs are decoded at once
+        :return: iterator yielding (index of first graph, np.array of shape (k, n, n)) for consecutive blocks
+        """
+        for first in range(0, len(self), block):
+            yield first, self[first:first + block]
+
+    def __iter__(self):
+        for first, Ms in self.blocks():
+            yield from Ms
+
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+
 def graph6_to_numpy_stack(path):
     """
     Graph6 specification <http://users.cecs.anu.edu.au/~bdm/data/formats.html>
     """
+    try:
+        # geng output: a single pass over a memory map of the file
+        return Graph6Stack(path)[:]
+    except ValueError:
+        pass
     with open(path, "rb") as file:
         # first, get a count of how many graphs there are
         num_graphs = 0
@@ -78,6 +199,155 @@ def adj_matrix_generator(path):
             i += 1
 
 
+def bitmask_dtype(n):
+    """
+    :param n: number of vertices
+    :return: the smallest unsigned numpy dtype holding an n bit neighbourhood bitmask
+    """
+    if n <= 8:
+        return np.uint8
+    if n <= 16:
+        return np.uint16
+    if n <= 32:
+        return np.uint32
+    return np.uint64
+
+
+def graph6_line_width(n):
+    """
+    :param n: number of vertices, at most 62
+    :return: number of bytes of a graph6 line for an n vertex graph, excluding the newline
+    """
+    return 1 + (n * (n - 1) // 2 + 5) // 6
+
+
+def _graph6_block_bits(rows, n):
+    """
+    :param rows: np.array of shape (num_graphs, width) of uint8, one fixed-width graph6 line per row
+    :param n: number of vertices
+    :return: (np.array of shape (num_graphs, n(n-1)/2) of the upper triangle bits, their rows, their columns)
+    """
+    num_pairs = n * (n - 1) // 2
+    data = rows[:, 1:graph6_line_width(n)] - np.uint8(63)
+    bits = (data[:, :, None] >> np.arange(5, -1, -1, dtype=np.uint8)) & np.uint8(1)
+    bits = bits.reshape(rows.shape[0], 6 * data.shape[1])[:, :num_pairs]
+    i, j = _graph6_pairs(n)
+    return bits, i, j
+
+
+def decode_graph6_block(rows, n):
+    """
+    Decodes a block of fixed-width graph6 lines in one vectorized pass.
+    :param rows: np.array of shape (num_graphs, width) of uint8, one graph6 line per row (trailing newline optional)
+    :param n: number of vertices of every graph in the block
+    :return: np.array of shape (num_graphs, n, n), the adjacency matrices
+    """
+    bits, i, j = _graph6_block_bits(rows, n)
+    Ms = np.zeros((rows.shape[0], n, n), dtype=np.uint8)
+    Ms[:, i, j] = bits
+    Ms[:, j, i] = bits
+    return Ms
+
+
+def decode_graph6_block_bitmasks(rows, n):
+    """
+    Decodes a block of fixed-width graph6 lines in one vectorized pass, without building adjacency matrices.
+    :param rows: np.array of shape (num_graphs, width) of uint8, one graph6 line per row (trailing newline optional)
+    :param n: number of vertices of every graph in the block
+    :return: np.array of shape (num_graphs, n), bit u of row g, column v is set iff u is adjacent to v in graph g
+    """
+    dtype = bitmask_dtype(n)
+    bits, rws, cols = _graph6_block_bits(rows, n)
+    bits = bits.astype(dtype)
+    masks = np.zeros((rows.shape[0], n), dtype=dtype)
+    for k in range(bits.shape[1]):
+        masks[:, rws[k]] |= bits[:, k] << dtype(cols[k])
+        masks[:, cols[k]] |= bits[:, k] << dtype(rws[k])
+    return masks
+
+
+def _graph6_pairs(n):
+    """
+    :param n: number of vertices
+    :return: (rows, columns) of the upper triangle in graph6 order, column by column: (0,1), (0,2), (1,2), (0,3), ...
+    """
+    i, j = np.triu_indices(n, 1)
+    order = np.lexsort((i, j))
+    return i[order], j[order]
+
+
+def encode_graph6_block_bitmasks(masks):
+    """
+    Encodes a block of equal-sized graphs as fixed-width graph6 lines in one vectorized pass.
+    :param masks: np.array of shape (num_graphs, n) of neighbourhood bitmasks
+    :return: np.array of shape (num_graphs, width) of uint8, one graph6 line (without newline) per row
+    """
+    num_graphs, n = masks.shape
+    width = graph6_line_width(n)
+    rws, cols = _graph6_pairs(n)
+    bits = np.zeros((num_graphs, 6 * (width - 1)), dtype=np.uint8)
+    bits[:, :rws.shape[0]] = (masks[:, cols] >> rws.astype(masks.dtype)) & 1
+    rows = np.empty((num_graphs, width), dtype=np.uint8)
+    rows[:, 0] = n + 63
+    weights = np.array([32, 16, 8, 4, 2, 1], dtype=np.uint8)
+    rows[:, 1:] = (bits.reshape(num_graphs, width - 1, 6) * weights).sum(axis=2, dtype=np.uint8) + np.uint8(63)
+    return rows
+
+
+def numpy_adjmatrix_to_g6_bytes(M):
+    """
+    :param M: adjacency matrix of graph G, at most 62 vertices
+    :return: the graph6 encoding of G as bytes, without newline
+    """
+    n = M.shape[0]
+    masks = (M.astype(bitmask_dtype(n)) << np.arange(n, dtype=bitmask_dtype(n))).sum(axis=1, dtype=bitmask_dtype(n))
+    return encode_graph6_block_bitmasks(masks[None])[0].tobytes()
+
+
+def _graph6_rows(buffer):
+    """
+    :param buffer: contents of a graph6 file of equal-sized graphs (as produced by geng for fixed n), no header
+    :return: (np.array of shape (num_graphs, width + 1), one line per row including its newline, n)
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    n = int(data[0]) - 63
+    width = graph6_line_width(n)
+    if data.shape[0] % (width + 1) or np.any(data[width::width + 1] != ord("\n")):
+        raise ValueError("graph6 lines are not all of the same length")
+    return data.reshape(-1, width + 1), n
+
+
+def graph6_to_numpy_stack_batch(path, block=1 << 20):
+    """
+    Same as graph6_to_numpy_stack, but reads the whole file in one go and decodes it in vectorized blocks of lines.
+    Only for files of equal-sized graphs with n <= 62, as produced by geng.
+    :param path: path for a graph6 file
+    :param block: how many graphs are decoded at once
+    :return: np.array of shape (num_graphs, n, n), the adjacency matrices
+    """
+    with open(path, "rb") as file:
+        rows, n = _graph6_rows(file.read())
+    Ms = np.empty((rows.shape[0], n, n), dtype=np.uint8)
+    for first in range(0, rows.shape[0], block):
+        Ms[first:first + block] = decode_graph6_block(rows[first:first + block], n)
+    return Ms
+
+
+def graph6_to_bitmask_stack(path, block=1 << 20):
+    """
+    Same as graph6_to_numpy_stack_batch, but returns neighbourhood bitmasks, n times smaller than adjacency matrices.
+    :param path: path for a graph6 file
+    :param block: how many graphs are decoded at once
+    :return: np.array of shape (num_graphs, n), bit u of row g, column v is set iff u is adjacent to v in graph g
+    """
+    with open(path, "rb") as file:
+        rows, n = _graph6_rows(file.read())
+    masks = np.empty((rows.shape[0], n), dtype=bitmask_dtype(n))
+    for first in range(0, rows.shape[0], block):
+        masks[first:first + block] = decode_graph6_block_bitmasks(rows[first:first + block], n)
+    return masks
+
+
 @njit
 def data_to_n(data):
     """Read initial one-, four- or eight-unit value from graph6
@@ -28,12 +28,20 @@ def shifty_bitstring_generator(n):
 
 
 @njit
-def ehrlich_permutation_generator(n):
-    a = np.arange(n, dtype=np.uint8)
+def ehrlich_star_transpositions(a):
+    """
+    Steps a through every permutation of its entries in place, in the order of Ehrlich's algorithm: each permutation
+    is reached from the previous one by swapping a[0] with a[j] for some j (a star transposition). Nothing is allocated
+    per permutation, and the swap tells the caller which positions changed, so per-word scratch state can be reused.
+    :param a: np.array, permuted in place; copy it to keep a permutation beyond the next step
+    :return: iterator yielding j for each permutation, once a holds it (0 for the first, a as given)
+    """
+    n = a.shape[0]
     b = np.arange(n, dtype=np.uint8)
     c = np.zeros(n + 1, dtype=np.uint8)  # c[0] should never be accessed; using arr of length n+1 to index starting at 1
+    j = 0
     while True:
-        yield a.copy()
+        yield j
         k = 1
         while c[k] == k:
             c[k] = 0
@@ -41,11 +49,191 @@ def ehrlich_permutation_generator(n):
         if k == n:
             return  # is break better?
         c[k] += 1
-        a[0], a[b[k]] = a[b[k]], a[0]
+        j = b[k]
+        a[0], a[j] = a[j], a[0]
         # reversing sublist as in textbook - swap for numpy impl. later if compatible with njit
-        j = 1
+        i = 1
         k = k - 1
-        while j < k:
-            b[j], b[k] = b[k], b[j]
-            j += 1
+        while i < k:
+            b[i], b[k] = b[k], b[i]
+            i += 1
             k -= 1
+
+
+@njit
+def ehrlich_permutation_generator(n):
+    a = np.arange(n, dtype=np.uint8)
+    for _ in ehrlich_star_transpositions(a):
+        yield a.copy()
+
+
+@njit
+def orbit_representative_generator(autos, word):
+    """
+    Steps word through one word per orbit of the automorphism group acting on words by relabelling (sigma maps the
+    word w to sigma[w]), namely the lexicographically smallest. A prefix is only extended by a vertex which is the
+    smallest in its orbit under the automorphisms fixing every vertex of the prefix. The action is free, so every orbit
+    has exactly len(autos) words.
+    :param autos: np.array of shape (k, n) listing the whole automorphism group, e.g. from automorphism_group
+    :param word: np.array of n entries, overwritten in place; copy it to keep a word beyond the next step
+    :return: iterator yielding i for the i-th word, once word holds it
+    """
+    k, n = autos.shape
+    count = 0
+    used = np.zeros(n, dtype=np.bool_)
+    # alive[d, a] iff automorphism a fixes the first d vertices of word
+    alive = np.ones((n + 1, k), dtype=np.bool_)
+    next_candidate = np.zeros(n + 1, dtype=np.int64)
+    depth = 0
+    while depth >= 0:
+        if depth == n:
+            yield count
+            count += 1
+            depth -= 1
+            used[word[depth]] = False
+            continue
+        v = next_candidate[depth]
+        if v == n:
+            next_candidate[depth] = 0
+            depth -= 1
+            if depth >= 0:
+                used[word[depth]] = False
+            continue
+        next_candidate[depth] = v + 1
+        if used[v]:
+            continue
+        smallest_in_orbit = True
+        for a in range(k):
+            if alive[depth, a] and autos[a, v] < v:
+                smallest_in_orbit = False
+                break
+        if not smallest_in_orbit:
+            continue
+        word[depth] = v
+        used[v] = True
+        for a in range(k):
+            alive[depth + 1, a] = alive[depth, a] and autos[a, v] == v
+        depth += 1
+
+
+@njit  # because math.factorial isn't supported by numba
+def factorial(n):
+    out = 1
+    for i in range(2, n + 1):
+        out *= i
+    return out
+
+
+@njit
+def rank_permutation(word):
+    """
+    :param word: a permutation of 0..n-1
+    :return: the rank of word in lexicographic order, computed from its Lehmer code
+    """
+    n = word.shape[0]
+    rank = 0
+    for i in range(n):
+        smaller_after = 0
+        for j in range(i + 1, n):
+            if word[j] < word[i]:
+                smaller_after += 1
+        rank += smaller_after * factorial(n - 1 - i)
+    return rank
+
+
+@njit
+def unrank_permutation(rank, n):
+    """
+    :param rank: an integer 0 <= rank < n!
+    :param n: length of the permutation
+    :return: np.array the permutation of 0..n-1 with the given rank in lexicographic order
+    """
+    word = np.empty(n, dtype=np.uint8)
+    remaining = np.arange(n, dtype=np.uint8)
+    for i in range(n):
+        f = factorial(n - 1 - i)
+        index = rank // f
+        rank %= f
+        word[i] = remaining[index]
+        for j in range(index, n - 1 - i):
+            remaining[j] = remaining[j + 1]
+    return word
+
+
+def rank_permutations(words):
+    """
+    Vectorized rank_permutation, for a whole table of words at once.
+    :param words: np.array of shape (k, n), each row a permutation of 0..n-1, n <= 20
+    :return: np.array of k np.uint64 lexicographic ranks
+    """
+    n = words.shape[1]
+    ranks = np.zeros(words.shape[0], dtype=np.uint64)
+    for i in range(n - 1):
+        smaller_after = np.count_nonzero(words[:, i + 1:] < words[:, i:i + 1], axis=1).astype(np.uint64)
+        ranks += smaller_after * np.uint64(factorial(n - 1 - i))
+    return ranks
+
+
+def unrank_permutations(ranks, n):
+    """
+    Vectorized unrank_permutation, for a whole table of ranks at once.
+    :param ranks: np.array of k integers 0 <= rank < n!, n <= 20
+    :param n: length of the permutations
+    :return: np.array of shape (k, n), the permutations of 0..n-1 with the given ranks in lexicographic order
+    """
+    ranks = np.asarray(ranks, dtype=np.uint64)
+    words = np.empty((ranks.shape[0], n), dtype=np.uint8)
+    # remaining[:, :n - i] lists the values not used by the first i positions, in increasing order
+    remaining = np.tile(np.arange(n, dtype=np.uint8), (ranks.shape[0], 1))
+    rows = np.arange(ranks.shape[0])
+    for i in range(n):
+        f = np.uint64(factorial(n - 1 - i))
+        index = (ranks // f).astype(np.int64)
+        ranks = ranks % f
+        words[:, i] = remaining[rows, index]
+        # drop the used value, shifting the ones after it down
+        keep = np.arange(n - i) != index[:, None]
+        remaining = remaining[:, :n - i][keep].reshape(ranks.shape[0], n - 1 - i)
+    return words
+
+
+@njit
+def next_permutation(word):
+    """
+    Steps word to its successor in lexicographic order, in place.
+    :param word: a permutation of 0..n-1
+    :return: False if word was the last permutation (and is left unchanged), True otherwise
+    """
+    n = word.shape[0]
+    i = n - 2
+    while i >= 0 and word[i] > word[i + 1]:
+        i -= 1
+    if i < 0:
+        return False
+    j = n - 1
+    while word[j] < word[i]:
+        j -= 1
+    word[i], word[j] = word[j], word[i]
+    j = n - 1
+    i += 1
+    while i < j:
+        word[i], word[j] = word[j], word[i]
+        i += 1
+        j -= 1
+    return True
+
+
+@njit
+def lexicographic_permutation_generator(word, start, stop):
+    """
+    Steps word through the permutations of 0..n-1 with ranks in range(start, stop), in lexicographic order, in place
+    (see next_permutation).
+    :param word: np.array of n entries, overwritten in place; copy it to keep a permutation beyond the next step
+    :param start: rank of the first permutation
+    :param stop: rank one past the last permutation, at most n!
+    :return: iterator yielding the rank of each permutation, once word holds it
+    """
+    word[:] = unrank_permutation(start, word.shape[0])
+    for rank in range(start, stop):
+        yield rank
+        next_permutation(word)
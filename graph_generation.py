@@ -0,0 +1,180 @@
+import numpy as np
+from numba import njit
+
+from automorphisms import automorphism_group, canonical_labelling, refine_colouring, canonical_graph6, orbits
+from permis import adjacency_matrix
+
+
+@njit
+def _connected_without(N, n, v):
+    """
+    :return: True if G - v is connected, i.e. v is not a cut vertex of the connected graph G
+    """
+    alive = ((1 << n) - 1) & ~(1 << v)
+    if alive == 0:
+        return True
+    start = 0 if v else 1
+    seen = 1 << start
+    frontier = seen
+    while frontier:
+        reached = 0
+        for u in range(n):
+            if (frontier >> u) & 1:
+                reached |= N[u]
+        frontier = reached & alive & ~seen
+        seen |= frontier
+    return seen == alive
+
+
+@njit
+def _is_canonical_augmentation(N):
+    """
+    Canonical construction path acceptance test: the parent of a connected graph G is G - c, for c its canonical
+    deletion vertex, the non-cut vertex with the largest refined colour (see refine_colouring), ties broken by the
+    largest canonical label. G obtained by adding vertex x = n - 1 is accepted iff x is in the orbit of c. Cheap
+    invariants (the degree, then the refined colour, of x) decide most cases before the canonical labelling is needed.
+    :param N: neighbourhood bitmasks of a connected graph G whose last vertex x was just added
+    :return: True if G is accepted, i.e. G - x is its parent
+    """
+    n = N.shape[0]
+    x = n - 1
+    non_cut = np.zeros(n, dtype=np.bool_)
+    degrees = np.zeros(n, dtype=np.int64)
+    max_degree = 0
+    for v in range(n):
+        non_cut[v] = v == x or _connected_without(N, n, v)
+        for u in range(n):
+            degrees[v] += (N[v] >> u) & 1
+        if non_cut[v] and degrees[v] > max_degree:
+            max_degree = degrees[v]
+    if degrees[x] < max_degree:
+        return False
+    M = adjacency_matrix(N)
+    colours = refine_colouring(M, np.zeros(n, dtype=np.int64))
+    best = -1
+    candidates = 0
+    for v in range(n):
+        if non_cut[v]:
+            if colours[v] > best:
+                best = colours[v]
+                candidates = 0
+            if colours[v] == best:
+                candidates += 1
+    if colours[x] != best:
+        return False
+    if candidates == 1:
+        return True
+    labelling, generators = canonical_labelling(M)
+    c = -1
+    for v in range(n):
+        if non_cut[v] and colours[v] == best and (c < 0 or labelling[v] > labelling[c]):
+            c = v
+    roots = orbits(generators, n)
+    return roots[c] == roots[x]
+
+
+@njit
+def augmentations(N):
+    """
+    :param N: neighbourhood bitmasks of a connected n vertex graph P
+    :return: np.array of shape (k, n + 1), the neighbourhood bitmasks of the connected n + 1 vertex graphs whose parent
+     is P (see _is_canonical_augmentation), one per isomorphism class. The new vertex is joined to one non-empty vertex
+     subset per orbit of Aut(P), the one with the smallest bitmask.
+    """
+    n = N.shape[0]
+    autos = automorphism_group(adjacency_matrix(N))
+    children = []
+    child = np.empty(n + 1, dtype=np.int64)
+    one = np.int64(1)
+    for S in range(1, 1 << n):
+        smallest_in_orbit = True
+        for a in range(autos.shape[0]):
+            image = 0
+            for v in range(n):
+                if (S >> v) & 1:
+                    image |= one << np.int64(autos[a, v])
+            if image < S:
+                smallest_in_orbit = False
+                break
+        if not smallest_in_orbit:
+            continue
+        for v in range(n):
+            child[v] = N[v] | (((S >> v) & 1) << n)
+        child[n] = S
+        if _is_canonical_augmentation(child):
+            children.append(child.copy())
+    out = np.empty((len(children), n + 1), dtype=np.int64)
+    for i in range(len(children)):
+        out[i] = children[i]
+    return out
+
+
+def connected_graphs(n, res=0, mod=1, split_level=None):
+    """
+    Generates the connected n vertex graphs up to isomorphism by canonical augmentation, one vertex at a time from K_1,
+    without any graph6 file. For parallel workers the graphs can be split into mod shards as geng does: the graphs on
+    split_level vertices are numbered in the order they are generated, and shard res only extends those numbered res
+    modulo mod, so every worker repeats the (cheap) generation up to split_level and the shards partition the output.
+    :param n: number of vertices, at least 1
+    :param res: which shard to generate, 0 <= res < mod
+    :param mod: number of shards
+    :param split_level: number of vertices at which the shards split, n - 2 by default (at least 1)
+    :return: iterator yielding the neighbourhood bitmasks of each graph, as np.array of n np.int64
+    """
+    if split_level is None:
+        split_level = max(n - 2, 1)
+    counter = 0
+
+    def extend(N):
+        nonlocal counter
+        k = N.shape[0]
+        if k == split_level:
+            counter += 1
+            if (counter - 1) % mod != res:
+                return
+        if k == n:
+            yield N
+            return
+        for child in augmentations(N):
+            yield from extend(child)
+
+    yield from extend(np.zeros(1, dtype=np.int64))
+
+
+def connected_graph_blocks(n, block=1 << 12, res=0, mod=1, split_level=None):
+    """
+    Same as connected_graphs, in blocks as expected by the batch kernels (e.g. permis.batch_find_permis).
+    :return: iterator yielding np.array of shape (k, n) of neighbourhood bitmasks, k <= block
+    """
+    masks = np.empty((block, n), dtype=np.int64)
+    k = 0
+    for N in connected_graphs(n, res, mod, split_level):
+        masks[k] = N
+        k += 1
+        if k == block:
+            yield masks.copy()
+            k = 0
+    if k:
+        yield masks[:k].copy()
+
+
+def validate_against_geng(n, mod=3):
+    """
+    Checks connected_graphs(n) against geng_outputs/graph{n}c.g6, as sets of canonical forms, and checks that the mod
+    shards partition it.
+    """
+    from g6_reader import Graph6Stack
+    from graph_utils import oeis_A001349
+    generated = [canonical_graph6(adjacency_matrix(N)) for N in connected_graphs(n)]
+    assert len(generated) == len(set(generated)) == oeis_A001349(n), f"wrong number of graphs for n={n}"
+    if n > 1:
+        geng = {canonical_graph6(M) for M in Graph6Stack(f"./geng_outputs/graph{n}c.g6")}
+        assert geng == set(generated), f"graphs differ from geng's for n={n}"
+    sharded = [canonical_graph6(adjacency_matrix(N)) for res in range(mod) for N in connected_graphs(n, res, mod)]
+    assert sorted(sharded) == sorted(generated), f"shards do not partition the graphs for n={n}"
+    print(f"Generated the {len(generated)} connected {n} vertex graphs, matching geng")
+
+
+if __name__ == "__main__":
+    for n in range(1, 10):
+        validate_against_geng(n)
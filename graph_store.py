@@ -0,0 +1,107 @@
+import numpy as np
+
+from g6_reader import Graph6Stack, bitmask_dtype, encode_graph6_block_bitmasks
+
+
+class BitmaskGraphStack:
+    """
+    Compact stack of n vertex graphs, each stored as its n neighbourhood bitmasks: masks[g, v] has bit u set iff u is
+    adjacent to v in graph g, as np.uint16 for n <= 16 and np.uint32 for n <= 32. That is n times smaller than an
+    (N, n, n) np.uint8 stack (about 235 MB rather than 1.2 GB for the connected 10 vertex graphs), and rows are in the
+    form the bitmask engines in permis.py work on.
+    stack[i] is still the adjacency matrix of graph i, so code indexing a numpy stack keeps working.
+    """
+
+    def __init__(self, masks):
+        """
+        :param masks: np.array of shape (num_graphs, n) of neighbourhood bitmasks
+        """
+        self.masks = masks
+        self.n = masks.shape[1]
+
+    @classmethod
+    def from_graph6(cls, path, block=1 << 20):
+        """
+        :param path: path for a graph6 file of equal-sized graphs, as produced by geng
+        :param block: how many graphs are decoded at once
+        """
+        stack = Graph6Stack(path)
+        masks = np.empty((len(stack), stack.n), dtype=bitmask_dtype(stack.n))
+        for first in range(0, len(stack), block):
+            masks[first:first + block] = stack.bitmasks(slice(first, first + block))
+        return cls(masks)
+
+    @classmethod
+    def from_matrices(cls, Ms):
+        """
+        :param Ms: np.array of shape (num_graphs, n, n), adjacency matrices
+        """
+        n = Ms.shape[1]
+        dtype = bitmask_dtype(n)
+        weights = np.left_shift(dtype(1), np.arange(n, dtype=dtype))
+        return cls(Ms.astype(dtype) @ weights)
+
+    @classmethod
+    def from_upper_triangle_bits(cls, packed, n):
+        """
+        :param packed: np.array of shape (num_graphs, ceil(n(n-1)/2 / 8)), as returned by upper_triangle_bits
+        :param n: number of vertices
+        """
+        rows, cols = np.triu_indices(n, 1)
+        bits = np.unpackbits(packed, axis=1, count=rows.shape[0]).astype(bitmask_dtype(n))
+        masks = np.zeros((packed.shape[0], n), dtype=bitmask_dtype(n))
+        for k in range(rows.shape[0]):
+            masks[:, rows[k]] |= bits[:, k] << masks.dtype.type(cols[k])
+            masks[:, cols[k]] |= bits[:, k] << masks.dtype.type(rows[k])
+        return cls(masks)
+
+    def __len__(self):
+        return self.masks.shape[0]
+
+    @property
+    def shape(self):
+        return len(self), self.n, self.n
+
+    def __getitem__(self, index):
+        return self.to_matrices(index)
+
+    def neighbourhoods(self, i):
+        """
+        :param i: index of a graph
+        :return: its neighbourhood bitmasks as np.int64, as expected by the engines in permis.py
+        """
+        return self.masks[i].astype(np.int64)
+
+    def to_matrices(self, index=slice(None)):
+        """
+        :param index: int, slice or np.array of indices
+        :return: the adjacency matrix of the graph (for an int), or np.array of shape (k, n, n) of them
+        """
+        masks = self.masks[index]
+        return ((masks[..., None] >> np.arange(self.n, dtype=masks.dtype)) & 1).astype(np.uint8)
+
+    def to_graph6(self, index=slice(None)):
+        """
+        :param index: slice or np.array of indices
+        :return: the graph6 lines of the indexed graphs as bytes, one per line
+        """
+        rows = encode_graph6_block_bitmasks(self.masks[index])
+        lines = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        lines[:, :-1] = rows
+        lines[:, -1] = ord("\n")
+        return lines.tobytes()
+
+    def upper_triangle_bits(self):
+        """
+        :return: np.array of shape (num_graphs, ceil(n(n-1)/2 / 8)), the upper triangle of every adjacency matrix in
+         row-major order packed 8 bits per byte; the most compact form, e.g. for storage
+        """
+        rows, cols = np.triu_indices(self.n, 1)
+        return np.packbits(((self.masks[:, rows] >> cols.astype(self.masks.dtype)) & 1).astype(np.uint8), axis=1)
+
+    def save(self, path):
+        np.save(path, self.masks)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        return cls(np.load(path, mmap_mode=mmap_mode))
@@ -2,11 +2,13 @@ import time
 
 from matplotlib import pyplot as plt
 
-from g6_reader import graph6_to_numpy_stack
+from g6_reader import graph6_to_numpy_stack, graph6_to_numpy_stack_batch, graph6_to_bitmask_stack
+from graph_store import BitmaskGraphStack
+from permis import neighbourhood_bitmasks
 import networkx as nx
 import numpy as np
 
-from numba import njit
+from numba import njit, prange
 
 
 def oeis_A001349(n):
@@ -48,19 +50,125 @@ def is_cycle(M):
 
 
 def has_induced_c_k(M, k):
-    n = M.shape[0]
-    if n < k:
+    return has_induced_cycle(neighbourhood_bitmasks(M), k)
+
+
+@njit
+def has_induced_cycle(N, k):
+    """
+    Looks for an induced C_k by extending chordless paths v_0, v_1, ... over the bitmask adjacency, where v_0 is the
+    smallest vertex of the cycle: the next vertex must be adjacent to the last one, larger than v_0, and not adjacent
+    to any earlier vertex of the path, except that the (k-1)th vertex must be adjacent to v_0 to close the cycle. Each
+    induced cycle is found at most twice (once per direction, then cut by v_1 < v_{k-1}), and no vertex subset is
+    visited more than once per path through it, unlike deleting vertices until k are left.
+    :param N: neighbourhood bitmasks of graph G, as returned by neighbourhood_bitmasks
+    :param k: length of the cycle, at least 3
+    :return: True if G has an induced cycle of length k
+    """
+    n = N.shape[0]
+    if k < 3 or n < k:
         return False
-    if n == k:
-        return is_cycle(M)
-    for del_v in range(n):
-        M_induced = np.delete(M, del_v, axis=0)
-        M_induced = np.delete(M_induced, del_v, axis=1)
-        if has_induced_c_k(M_induced, k):
+    path = np.empty(k, dtype=np.int64)
+    # candidates[j]: the vertices not tried yet as v_j
+    candidates = np.zeros(k, dtype=np.int64)
+    # blocked[j]: the vertices on the path or adjacent to one of v_1, ..., v_{j-2}, so they cannot be v_j
+    blocked = np.zeros(k, dtype=np.int64)
+    for start in range(n - k + 1):
+        above = ((1 << n) - 1) & ~((1 << (start + 1)) - 1)
+        path[0] = start
+        candidates[1] = N[start] & above
+        blocked[1] = 1 << start
+        j = 1
+        while j > 0:
+            if not candidates[j]:
+                j -= 1
+                continue
+            v = 0
+            while not (candidates[j] >> v) & 1:
+                v += 1
+            candidates[j] &= ~(1 << v)
+            path[j] = v
+            if j == k - 1:
+                if path[k - 1] > path[1]:
+                    return True
+                continue
+            # v_{j+1}: adjacent to v_j, and to none of v_0, ..., v_{j-1} (but to v_0 if it closes the cycle)
+            blocked[j + 1] = blocked[j] | (1 << v)
+            if j >= 2:
+                blocked[j + 1] |= N[path[j - 1]]
+            reach = N[v] & above & ~blocked[j + 1]
+            if j + 1 == k - 1:
+                reach &= N[start]
+            else:
+                reach &= ~N[start]
+            candidates[j + 1] = reach
+            j += 1
+    return False
+
+
+@njit
+def complement_bitmasks(N):
+    """
+    :return: the neighbourhood bitmasks of the complement of G
+    """
+    n = N.shape[0]
+    everyone = (1 << n) - 1
+    out = np.empty_like(N)
+    for v in range(n):
+        out[v] = everyone & ~N[v] & ~(1 << v)
+    return out
+
+
+@njit
+def has_odd_hole(N):
+    """
+    :return: True if G has an induced odd cycle of length at least 5
+    """
+    for k in range(5, N.shape[0] + 1, 2):
+        if has_induced_cycle(N, k):
             return True
     return False
 
 
+@njit
+def has_odd_antihole(N):
+    """
+    :return: True if the complement of G has an induced odd cycle of length at least 5
+    """
+    return has_odd_hole(complement_bitmasks(N))
+
+
+@njit(parallel=True)
+def batch_has_induced_cycle(masks, k, complement=False):
+    """
+    :param masks: np.array of shape (num_graphs, n) of neighbourhood bitmasks, see graph_store.BitmaskGraphStack
+    :param k: length of the cycle
+    :param complement: if True, look for induced C_k in the complements (anti-holes) instead
+    :return: np.array of num_graphs bools, whether each graph has an induced C_k
+    """
+    out = np.zeros(masks.shape[0], dtype=np.bool_)
+    for g in prange(masks.shape[0]):
+        N = masks[g].astype(np.int64)
+        out[g] = has_induced_cycle(complement_bitmasks(N) if complement else N, k)
+    return out
+
+
+@njit(parallel=True)
+def batch_perfection_screen(masks):
+    """
+    Screens a whole stack of graphs for the obstructions to perfection (strong perfect graph theorem).
+    :param masks: np.array of shape (num_graphs, n) of neighbourhood bitmasks, see graph_store.BitmaskGraphStack
+    :return: (odd_holes, odd_antiholes), np.arrays of num_graphs bools
+    """
+    odd_holes = np.zeros(masks.shape[0], dtype=np.bool_)
+    odd_antiholes = np.zeros(masks.shape[0], dtype=np.bool_)
+    for g in prange(masks.shape[0]):
+        N = masks[g].astype(np.int64)
+        odd_holes[g] = has_odd_hole(N)
+        odd_antiholes[g] = has_odd_antihole(N)
+    return odd_holes, odd_antiholes
+
+
 def nx_loader(n):
     return nx.read_graph6(f'geng_outputs/graph{n}c.g6')
 
@@ -69,6 +177,14 @@ def optimized_loader(n):
     return graph6_to_numpy_stack(f'geng_outputs/graph{n}c.g6')
 
 
+def batch_loader(n):
+    return graph6_to_numpy_stack_batch(f'geng_outputs/graph{n}c.g6')
+
+
+def batch_bitmask_loader(n):
+    return graph6_to_bitmask_stack(f'geng_outputs/graph{n}c.g6')
+
+
 def matrices_for(Gs):
     Ms = [nx.to_numpy_array(G) for G in Gs]
     return Ms
@@ -83,6 +199,10 @@ def np_mat_for(Gs):
     return Ms
 
 
+def bitmask_stack_for(Gs):
+    return BitmaskGraphStack.from_matrices(np_mat_for(Gs).astype(np.uint8))
+
+
 def test_mat_conversion(n, reps=10):
     Gs = nx_loader(n)
     for mat_for in [np_mat_for, matrices_for]:
@@ -100,12 +220,13 @@ def test_mat_conversion(n, reps=10):
 
 def test_g6_load(n, reps=10):
     print(f"Evaluating g6 load time")
-    times = []
+    loaders = [nx_loader, optimized_loader, batch_loader, batch_bitmask_loader]
     # Get numba jitted
-
-    print("Warmed up:", Gs)
-    for loader in [nx_loader, optimized_loader]:
+    for loader in loaders:
+        loader(3)
+    for loader in loaders:
         print(f"---Evaluating loader {loader.__name__}---")
+        times = []
         for it in range(reps):
             start = time.perf_counter()
             Gs = loader(n)
@@ -1,17 +1,99 @@
-from permis import has_permis, find_permis, find_permis_whp, has_permis_hybrid_BAD
-from g6_reader import adj_matrix_generator
-from generators import filter_generator
+import heapq
+import os
+import queue
+import tempfile
+from functools import partial
+
+from permis import has_permis, find_permis, find_permis_whp, has_permis_hybrid_BAD, find_permis_rank_in_range, \
+    batch_find_permis, adjacency_matrix, find_permis_annealing, ENGINE_BITSLICED
+from automorphisms import automorphism_group
+from g6_reader import adj_matrix_generator, Graph6Stack, bitmask_dtype
+from graph_generation import connected_graph_blocks
+from generators import factorial, unrank_permutation
 from graph_utils import oeis_A001349
+from table_io import CheckpointedTable, ShardedTableWriter, RankedPermisTable, iter_blocks, rank_dtype, \
+    encode_permises, permis_table_exists
+from seeding import parent_permis_index, find_permis_seeded
+from permis_cache import open_cache
 # from multiprocessing.pool import ThreadPool
 from multiprocessing import Pool
 import numpy as np
 from time import perf_counter
 
 
-def classify_graphs_on(n, processes=16, chunksize=128):
+# in each worker: the graph stack and output table of the most recent shared_dispatch, mapped on first use
+_attached = {}
+
+
+def _attach(path, table_path):
+    if _attached.get("key") != (path, table_path):
+        _attached.update(key=(path, table_path), stack=Graph6Stack(path),
+                         out=np.load(table_path, mmap_mode="r+"))
+    return _attached["stack"], _attached["out"]
+
+
+def _run_on_shared_range(task):
+    func, path, table_path, start, stop, batched = task
+    stack, out = _attach(path, table_path)
+    if batched:
+        out[start:stop] = func(stack.bitmasks(slice(start, stop)))
+        return start, stop
+    for i, M in enumerate(stack[start:stop], start=start):
+        out[i] = func(M)
+    return start, stop
+
+
+def shared_dispatch(pool, func, path, row_shape=(), dtype=np.uint8, chunksize=4096, batched=False, checkpoint=None):
+    """
+    Applies func to every graph of a graph6 file on the pool without pickling any graph or result: the workers map
+    the file themselves (see Graph6Stack), tasks are just index ranges, and results are written straight into a
+    shared output table, a memory-mapped .npy in shared memory (/dev/shm) where available.
+    :param pool: multiprocessing.Pool
+    :param func: picklable function of an adjacency matrix, e.g. partial(has_permis, engine=engine)
+    :param path: path for a graph6 file of equal-sized graphs, as produced by geng
+    :param row_shape: shape of the result of func, () for a scalar
+    :param dtype: dtype of the result of func
+    :param chunksize: number of graphs per task
+    :param batched: if True, func is instead called once per task on the neighbourhood bitmasks of all of its graphs
+     (e.g. partial(batch_find_permis, words=words)) and returns all of their results
+    :param checkpoint: a CheckpointedTable of shape (num_graphs, *row_shape) to write the results into instead; only
+     ranges with graphs not done yet are dispatched, and each range is marked done as it returns
+    :return: np.array of shape (num_graphs, *row_shape), the results (checkpoint.table if a checkpoint is given)
+    """
+    num_graphs = len(Graph6Stack(path))
+    if checkpoint is not None:
+        tasks = ((func, path, checkpoint.table_path, start, min(start + chunksize, num_graphs), batched)
+                 for start in range(0, num_graphs, chunksize) if checkpoint.pending(start, start + chunksize).size)
+        for start, stop in pool.imap_unordered(_run_on_shared_range, tasks):
+            checkpoint.mark_done(slice(start, stop))
+        return checkpoint.table
+    shape = (num_graphs,) + tuple(row_shape)
+    handle, table_path = tempfile.mkstemp(suffix=".npy", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    os.close(handle)
+    try:
+        out = np.lib.format.open_memmap(table_path, mode="w+", dtype=dtype, shape=shape)
+        tasks = ((func, path, table_path, start, min(start + chunksize, num_graphs), batched)
+                 for start in range(0, num_graphs, chunksize))
+        for _ in pool.imap_unordered(_run_on_shared_range, tasks):
+            pass
+        out_arr = np.array(out)
+        del out
+    finally:
+        os.remove(table_path)
+    return out_arr
+
+
+def classify_graphs_on(n, processes=16, chunksize=128, engine=ENGINE_BITSLICED, shared=False, cache=None):
+    """
+    :param cache: a PermisCache to consult before searching and to record new results in, or None
+    """
+    func = partial(has_permis if cache is None else cache.has_permis, engine=engine)
+    if shared:
+        with Pool(processes=processes) as pool:
+            return shared_dispatch(pool, func, f"./geng_outputs/graph{n}c.g6", chunksize=chunksize)
     graph_iterable = adj_matrix_generator(f"./geng_outputs/graph{n}c.g6")
     with Pool(processes=processes) as pool:
-        results = pool.imap(has_permis, graph_iterable, chunksize=chunksize)
+        results = pool.imap(func, graph_iterable, chunksize=chunksize)
         num_graphs = oeis_A001349(n)
         out_arr = np.empty(num_graphs, dtype=np.uint8)
         for res, i in zip(results, range(num_graphs)):
@@ -19,10 +101,30 @@ def classify_graphs_on(n, processes=16, chunksize=128):
     return out_arr
 
 
-def get_permises(n, processes=16, chunksize=128):
+def get_permises(n, processes=16, chunksize=128, engine=ENGINE_BITSLICED, shared=False, cache=None, out=None):
+    """
+    :param cache: a PermisCache to consult before searching and to record new results in, or None
+    :param out: if given, a directory to stream the table to as it is produced (see ShardedTableWriter), rather than
+     holding it in memory; the table is then returned as a ShardedTable. Not with shared
+    """
+    func = partial(find_permis if cache is None else cache.find_permis, engine=engine)
+    if out is not None:
+        if shared:
+            raise ValueError("get_permises cannot stream a shared_dispatch table")
+        table = ShardedTableWriter(out, oeis_A001349(n), (n,))
+        stack = Graph6Stack(f"./geng_outputs/graph{n}c.g6")
+        pending = table.pending()
+        with Pool(processes=processes) as pool:
+            results = pool.imap(func, (stack[i] for i in pending), chunksize=chunksize)
+            for i, res in zip(pending, results):
+                table[i] = res
+        return table.finish()
+    if shared:
+        with Pool(processes=processes) as pool:
+            return shared_dispatch(pool, func, f"./geng_outputs/graph{n}c.g6", row_shape=(n,), chunksize=chunksize)
     graph_iterable = adj_matrix_generator(f"./geng_outputs/graph{n}c.g6")
     with Pool(processes=processes) as pool:
-        results = pool.imap(find_permis, graph_iterable, chunksize=chunksize)
+        results = pool.imap(func, graph_iterable, chunksize=chunksize)
         num_graphs = oeis_A001349(n)
         out_arr = np.empty((num_graphs, n), dtype=np.uint8)
         for res, i in zip(results, range(num_graphs)):
@@ -30,19 +132,87 @@ def get_permises(n, processes=16, chunksize=128):
     return out_arr
 
 
-def test_time(func, n=7, processes=32, chunksize=256, reps=10):
+# in each worker: one flag per graph id, set once a permis has been found for that graph, see cancellation_flags
+_cancelled = None
+
+
+def _init_cancellation(flags_path):
+    global _cancelled
+    _cancelled = np.load(flags_path, mmap_mode="r")
+
+
+def cancellation_flags(num_graphs):
+    """
+    Cancel flags for find_permis_across_pool, one per graph id, so that finding a permis for one graph never cancels
+    the search of another: a memory-mapped .npy of bools in shared memory (/dev/shm) where available, which the
+    workers map by name (see _init_cancellation). The file is sparse, so only the pages of flags set take memory.
+    :param num_graphs: number of graph ids, the ids being 0..num_graphs-1
+    :return: (file, flags), the temporary file, removed when closed, and np.array of num_graphs bools mapped from it
+    """
+    file = tempfile.NamedTemporaryFile(suffix=".npy", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    return file, np.lib.format.open_memmap(file.name, mode="w+", dtype=np.bool_, shape=(num_graphs,))
+
+
+def _find_permis_rank_in_ranks(task):
+    graph_id, M, start, stop, autos, engine, block = task
+    for block_start in range(start, stop, block):
+        # cooperative cancellation: stop as soon as another worker has found a permis for this graph
+        if _cancelled[graph_id]:
+            return -1
+        rank = find_permis_rank_in_range(M, block_start, min(stop, block_start + block), autos, engine)
+        if rank >= 0:
+            return rank
+    return -1
+
+
+def find_permis_across_pool(pool, cancelled, graph_id, M, num_ranges=256, engine=ENGINE_BITSLICED,
+                            automorphisms=True, block=8192):
+    """
+    Splits the n! words of one graph into rank ranges and searches them on every worker of the pool, so that a single
+    hard (e.g. permisless) graph runs at full machine width. The pool must have been created with
+    initializer=_init_cancellation, initargs=(file.name,) for (file, cancelled) = cancellation_flags(num_graphs).
+    :param pool: multiprocessing.Pool
+    :param cancelled: the flags of cancellation_flags the pool was initialized with
+    :param graph_id: an id for M below len(cancelled), distinct from the ids of other graphs searched on this pool
+    :param M: adjacency matrix of graph G
+    :param num_ranges: number of rank ranges, typically a few times the number of processes
+    :param engine: one of the ENGINE_* constants
+    :param automorphisms: if True, only try one word per orbit of Aut(G)
+    :param block: how many words a worker tries between checks for cancellation
+    :return: np.array a permis for graph G if one exists, or np.zeros(n) otherwise.
+    """
+    n = M.shape[0]
+    total = factorial(n)
+    autos = automorphism_group(M) if automorphisms else np.arange(n, dtype=np.uint8).reshape(1, n)
+    tasks = [(graph_id, M, total * r // num_ranges, total * (r + 1) // num_ranges, autos, engine, block)
+             for r in range(num_ranges)]
+    permis = np.zeros(n, dtype=np.uint8)
+    found = False
+    for rank in pool.imap_unordered(_find_permis_rank_in_ranks, tasks):
+        if rank >= 0 and not found:
+            permis = unrank_permutation(rank, n)
+            found = True
+            cancelled[graph_id] = True
+    return permis
+
+
+def test_time(func, n=7, processes=32, chunksize=256, reps=10, shared=False):
     times = []
     counts = []
     print(f"\n--- Running function {func.__name__} with n={n}, {processes} processes, {chunksize} chunksize,"
-          f" including generator initialization ---")
+          f" {'shared memory' if shared else 'imap'} dispatch, including generator initialization ---")
     with Pool(processes=processes) as pool:
         for it in range(reps + 1):
             start = perf_counter()
-            graph_iterable = adj_matrix_generator(f"./geng_outputs/graph{n}c.g6")
-            result = pool.imap(func, graph_iterable, chunksize=chunksize)
-            # must do something with results, otherwise they won't be evaluated because imap is lazy
-            # here, just sum() because we are interested in comparing the time to compute the results
-            count = sum(result)
+            if shared:
+                count = int(np.sum(shared_dispatch(pool, func, f"./geng_outputs/graph{n}c.g6", dtype=np.int64,
+                                                   chunksize=chunksize)))
+            else:
+                graph_iterable = adj_matrix_generator(f"./geng_outputs/graph{n}c.g6")
+                result = pool.imap(func, graph_iterable, chunksize=chunksize)
+                # must do something with results, otherwise they won't be evaluated because imap is lazy
+                # here, just sum() because we are interested in comparing the time to compute the results
+                count = sum(result)
             stop = perf_counter()
             print(f"Finished run {it:2} with {n} vertex graphs in {stop - start:.3f} seconds, found {count} permises")
             if it > 0:
@@ -54,65 +224,314 @@ def test_time(func, n=7, processes=32, chunksize=256, reps=10):
           f" finds {np.mean(counts):.0f} ± {np.std(counts):.0f} permises")
 
 
-def hybrid_permis_finder(n, processes=32, chunksize=4096):
+_parent_index = None  # set in each worker by _init_hybrid_worker, see hybrid_permis_finder
+
+
+def _init_hybrid_worker(flags_path, parent_index):
+    global _parent_index
+    _init_cancellation(flags_path)
+    _parent_index = parent_index
+
+
+def _find_permis_whp_chunk(task):
+    indices, Ms, tries, engine, cache, anneal = task
+    permises = []
+    known = []  # whether the result is a verdict from the cache, rather than a w.h.p. one
+    for M in Ms:
+        cached = None if cache is None else cache.lookup(M)
+        if cached is not None and (cached.permis is not None or not cached.has_permis):
+            permises.append(cached.permis if cached.has_permis else np.zeros(M.shape[0], dtype=np.uint8))
+            known.append(True)
+            continue
+        permis = None
+        if _parent_index is not None:
+            permis, _ = find_permis_seeded(M, _parent_index, engine)
+        if permis is None or not np.any(permis):
+            permis = find_permis_whp(M, tries, engine)
+        if anneal and not np.any(permis):
+            permis = find_permis_annealing(M)
+        if cache is not None and np.any(permis):
+            cache.store(M, 1, permis)
+        permises.append(permis)
+        known.append(False)
+    return indices, permises, known
+
+
+def hybrid_permis_finder(n, processes=32, chunksize=1024, engine=ENGINE_BITSLICED, tries=1000, ranges_per_graph=None,
+                         report_every=10.0, seeded=True, cache=None, sharded=False, ranked=False, anneal=True):
+    """
+    Finds a permis for every connected n vertex graph (or that there is none) with a single scheduler for both phases.
+    Graphs are streamed from the graph6 file in chunks, and every chunk first gets the cheap attempt: the seeds built
+    from the permises of the n - 1 vertex subgraphs (see find_permis_seeded), then find_permis_whp, then
+    find_permis_annealing.
+    Each graph that survives it goes straight into a priority queue as rank range tasks for an exhaustive search (see
+    find_permis_across_pool). Whenever a worker frees up it is handed the most urgent queued exhaustive task, or the
+    next chunk if the queue is empty, so both phases overlap and no worker idles on a straggler. Queued ranges of a
+    graph which has been solved are dropped, and running ones are cancelled.
+    Results are checkpointed to disk as they come in (see CheckpointedTable), and a run restarted after a crash skips
+    the graphs already done; only the exhaustive searches that were in progress are lost.
+    :param n: number of vertices
+    :param processes: number of worker processes
+    :param chunksize: how many graphs are sent to a worker at once for the w.h.p. phase
+    :param engine: one of the ENGINE_* constants
+    :param tries: how many random words find_permis_whp tries per graph
+    :param ranges_per_graph: how many rank range tasks the exhaustive search of one graph is split into
+    :param report_every: seconds between progress reports (throughput of each phase and queue depth)
+    :param seeded: if True, and the permis table for n - 1 vertices exists, try seeds from it before random words
+    :param cache: a PermisCache to consult before searching and to record new results in, or None
+    :param sharded: if True, the table is written out of core as shards in permis_tables/permises_for_g{n}c/ (see
+     ShardedTableWriter), for n large enough that the table does not fit in memory
+    :param ranked: if True, the table is rank encoded (see encode_permises), as permis_tables/permis_ranks_for_g{n}c
+    :param anneal: if True, graphs which survive the random words get a local search before the exhaustive phase
+    """
     print(f"\n--- Running hybrid permis finder with n={n}, {processes} processes, {chunksize} chunksize ---")
-    with Pool(processes=processes) as pool:
-        num_graphs = oeis_A001349(n)
-        permis_table = np.zeros((num_graphs, n), dtype=np.uint8)
-        start = perf_counter()
-        graph_iterable = adj_matrix_generator(f"./geng_outputs/graph{n}c.g6")
-        print("Calling imap...")
-        result = pool.imap(find_permis_whp, graph_iterable, chunksize=chunksize)
-        print("Iterating over results...")
-        for permis, i in zip(result, range(num_graphs)):
-            permis_table[i] = permis
-        stop = perf_counter()
+    if ranges_per_graph is None:
+        ranges_per_graph = 4 * processes
+    num_graphs = oeis_A001349(n)
+    total = factorial(n)
+    path, row_shape, dtype = f"permis_tables/permises_for_g{n}c", (n,), np.uint8
+    if ranked:
+        path, row_shape, dtype = f"permis_tables/permis_ranks_for_g{n}c", (), rank_dtype(n)
+    if sharded:
+        table = ShardedTableWriter(path, num_graphs, row_shape, dtype)
+    else:
+        table = CheckpointedTable(path + ".npy", num_graphs, row_shape, dtype)
+    if table.num_done():
+        print(f"Resuming from checkpoint, {table.num_done()} graphs already done")
+    found = {}  # graph index -> permis, for graphs in the exhaustive phase which have been solved
+    awaiting_whp = {}  # graph index -> adjacency matrix, for graphs whose w.h.p. attempt has not returned yet
+    remaining_ranges = {}  # graph index -> number of its rank range tasks not yet returned or dropped
+    exhaustive_matrices = {}  # graph index -> adjacency matrix, for graphs in the exhaustive phase
+    exhaustive_queue = []  # heap of (graph index, range number, task); lowest graph index first, so graphs finish
+    done = queue.Queue()
+    flags_file, cancelled = cancellation_flags(num_graphs)
+    stack = Graph6Stack(f"./geng_outputs/graph{n}c.g6")
+    parent_index = None
+    if seeded and permis_table_exists(n - 1):
+        parent_index = parent_permis_index(n - 1)
+    next_index = 0
+    in_flight = 0
+    whp_graphs = exhaustive_graphs = exhaustive_ranges = 0
+    start = last_report = perf_counter()
 
-        # fresh graph iterable; each one runs through file once, need to reset to file start
-        graph_iterable = adj_matrix_generator(f"./geng_outputs/graph{n}c.g6")
-        # find which graphs have no permis with high probability (because we haven't found one yet)
-        whp_permisless = (np.sum(permis_table, axis=1) == 0)
-        whp_permisless_graphs = filter_generator(graph_iterable, whp_permisless)
-        result = pool.imap(find_permis, whp_permisless_graphs, chunksize=1)  # use chunksize 1 - each task expensive
-        whp_permisless_indices = np.where(whp_permisless)[0]
-        count = num_graphs - len(whp_permisless_indices)
-        print(f"Random run finished in {stop - start:.3f} seconds, {num_graphs - count} "
-              f"graphs are permisless w.h.p.; {count} permises found")
-        for (permis, index) in zip(result, whp_permisless_indices):
-            permis_table[index] = permis
-            count += np.any(permis)
-        stop = perf_counter()
-        np.save(f"permis_tables/permises_for_g{n}c.npy", permis_table)
-        print(f"Finished update of permis_table for {n} vertex graphs in {stop - start:.3f} seconds,"
-              f" {num_graphs - count} graphs are permisless; {count} permises found")
+    def report():
+        elapsed = perf_counter() - start
+        print(f"{elapsed:9.1f}s: w.h.p. phase {whp_graphs} graphs ({whp_graphs / elapsed:.0f}/s), "
+              f"exhaustive phase {exhaustive_graphs} graphs, {exhaustive_ranges} ranges "
+              f"({exhaustive_ranges / elapsed:.1f}/s), queue depth {len(exhaustive_queue)} ranges "
+              f"of {len(remaining_ranges)} graphs")
+
+    def record(index, permis):
+        table[index] = encode_permises(permis[None])[0] if ranked else permis
+
+    def finish_exhaustive(index):
+        nonlocal exhaustive_graphs
+        del remaining_ranges[index]
+        M = exhaustive_matrices.pop(index)
+        permis = found.pop(index, None)
+        record(index, np.zeros(n, dtype=np.uint8) if permis is None else permis)
+        if cache is not None:
+            cache.store(M, permis is not None, permis, 0 if permis is None else None)
+        exhaustive_graphs += 1
+
+    with flags_file, Pool(processes=processes, initializer=_init_hybrid_worker,
+                          initargs=(flags_file.name, parent_index)) as pool:
+        while True:
+            # keep every worker busy, preferring queued exhaustive tasks over new graphs
+            while in_flight < 2 * processes:
+                if exhaustive_queue:
+                    index, r, task = heapq.heappop(exhaustive_queue)
+                    if index in found:
+                        remaining_ranges[index] -= 1
+                        if not remaining_ranges[index]:
+                            finish_exhaustive(index)
+                        continue
+                    pool.apply_async(_find_permis_rank_in_ranks, (task,),
+                                     callback=lambda rank, i=index: done.put(("exhaustive", i, rank)),
+                                     error_callback=lambda e: done.put(("error", None, e)))
+                elif next_index < num_graphs:
+                    indices = table.pending(next_index, next_index + chunksize)
+                    next_index += chunksize
+                    if not indices.size:
+                        continue
+                    Ms = stack[indices]
+                    pool.apply_async(_find_permis_whp_chunk, ((indices, Ms, tries, engine, cache, anneal),),
+                                     callback=lambda result: done.put(("whp", None, result)),
+                                     error_callback=lambda e: done.put(("error", None, e)))
+                    awaiting_whp.update(zip(indices, Ms))
+                else:
+                    break
+                in_flight += 1
+            if not in_flight:
+                break
+            kind, index, result = done.get()
+            in_flight -= 1
+            if kind == "error":
+                raise result
+            if kind == "whp":
+                indices, permises, known = result
+                whp_graphs += len(permises)
+                for i, permis, verdict in zip(indices, permises, known):
+                    M = awaiting_whp.pop(i)
+                    if np.any(permis) or verdict:
+                        # solved, or known to be permisless
+                        record(i, permis)
+                        continue
+                    # permisless w.h.p.: queue an exhaustive search of the graph up to automorphism
+                    autos = automorphism_group(M)
+                    for r in range(ranges_per_graph):
+                        task = (i, M, total * r // ranges_per_graph, total * (r + 1) // ranges_per_graph, autos,
+                                engine, 8192)
+                        heapq.heappush(exhaustive_queue, (i, r, task))
+                    remaining_ranges[i] = ranges_per_graph
+                    exhaustive_matrices[i] = M
+            else:
+                exhaustive_ranges += 1
+                if result >= 0 and index not in found:
+                    found[index] = unrank_permutation(result, n)
+                    cancelled[index] = True
+                remaining_ranges[index] -= 1
+                if not remaining_ranges[index]:
+                    finish_exhaustive(index)
+            if perf_counter() - last_report > report_every:
+                report()
+                last_report = perf_counter()
+    report()
+    permis_table = RankedPermisTable(table.finish(), n) if ranked else table.finish()
+    count = sum(int(np.count_nonzero(np.any(rows, axis=1))) for _, rows in iter_blocks(permis_table))
+    print(f"Finished permis_table for {n} vertex graphs in {perf_counter() - start:.3f} seconds,"
+          f" {num_graphs - count} graphs are permisless; {count} permises found")
+
+
+def _batch_find_permis_cached(masks, words, engine, cache):
+    """
+    batch_find_permis, with the graphs known to cache answered from it and the permises found recorded in it
+    """
+    permises = np.zeros(masks.shape, dtype=np.uint8)
+    unknown = []
+    for g in range(masks.shape[0]):
+        cached = cache.lookup(adjacency_matrix(masks[g].astype(np.int64)))
+        if cached is None or (cached.permis is None and cached.has_permis):
+            unknown.append(g)
+        elif cached.has_permis:
+            permises[g] = cached.permis
+    unknown = np.array(unknown, dtype=np.int64)
+    if unknown.size:
+        permises[unknown] = batch_find_permis(masks[unknown], words, engine)
+        for g in unknown:
+            if np.any(permises[g]):
+                cache.store(adjacency_matrix(masks[g].astype(np.int64)), 1, permises[g])
+    return permises
 
 
-def whp_processor(n, processes=32, chunksize=4096):
+def whp_processor(n, processes=32, chunksize=4096, engine=ENGINE_BITSLICED, tries=1000, batched=False, cache=None):
+    """
+    Results are checkpointed to disk chunk by chunk (see CheckpointedTable), and a run restarted after a crash only
+    processes the chunks not done yet.
+    :param batched: if True, the identity and the same tries random words are tried on a whole chunk of graphs at a
+     time with batch_find_permis, rather than find_permis_whp drawing fresh random words for every graph
+    :param cache: a PermisCache to consult before searching and to record new permises in, or None
+    """
     print(f"\n--- Running whp permis preprocessor with n={n}, {processes} processes, {chunksize} chunksize ---")
     with Pool(processes=processes) as pool:
         num_graphs = oeis_A001349(n)
-        permis_table = np.zeros((num_graphs, n), dtype=np.uint8)
+        table = CheckpointedTable(f"permis_tables/PARTIAL_permises_for_g{n}c_1k_tries.npy", num_graphs, (n,))
+        if table.num_done():
+            print(f"Resuming from checkpoint, {table.num_done()} graphs already done")
         start = perf_counter()
-        graph_iterable = adj_matrix_generator(f"./geng_outputs/graph{n}c.g6")
-        print("Calling imap...")
-        result = pool.imap(find_permis_whp, graph_iterable, chunksize=chunksize)
-        print("Iterating over results...")
-        for permis, i in zip(result, range(num_graphs)):
-            permis_table[i] = permis
+        if batched:
+            words = np.empty((tries + 1, n), dtype=np.uint8)
+            words[0] = np.arange(n)
+            for i in range(1, tries + 1):
+                words[i] = np.random.permutation(n)
+            print("Dispatching blocks...")
+            func = partial(batch_find_permis, words=words, engine=engine) if cache is None else \
+                partial(_batch_find_permis_cached, words=words, engine=engine, cache=cache)
+            shared_dispatch(pool, func, f"./geng_outputs/graph{n}c.g6", row_shape=(n,), chunksize=chunksize,
+                            batched=True, checkpoint=table)
+        else:
+            print("Dispatching ranges...")
+            func = partial(find_permis_whp if cache is None else cache.find_permis_whp, tries=tries, engine=engine)
+            shared_dispatch(pool, func, f"./geng_outputs/graph{n}c.g6", row_shape=(n,), chunksize=chunksize,
+                            checkpoint=table)
         stop = perf_counter()
+        permis_table = table.finish()
         # find which graphs have no permis with high probability (because we haven't found one yet)
         whp_permisless = (np.sum(permis_table, axis=1) == 0)
         whp_permisless_indices = np.where(whp_permisless)[0]
         count = num_graphs - len(whp_permisless_indices)
         print(f"Random run finished in {stop - start:.3f} seconds, {num_graphs - count} "
               f"graphs are permisless w.h.p.; {count} permises found")
-        np.save(f"permis_tables/PARTIAL_permises_for_g{n}c_1k_tries.npy", permis_table)
         print("File saved.")
 
 
+def _find_permises_of_generated_shard(task):
+    n, res, mod, words, engine, out_dir = task
+    masks_path = os.path.join(out_dir, f"masks_{res:05d}.npy")
+    permises_path = os.path.join(out_dir, f"permises_{res:05d}.npy")
+    if os.path.exists(masks_path) and os.path.exists(permises_path):
+        # done by an earlier run
+        permises = np.load(permises_path, mmap_mode="r")
+        return res, len(permises), int(np.count_nonzero(~np.any(permises, axis=1)))
+    masks_blocks = []
+    permises_blocks = []
+    for masks in connected_graph_blocks(n, res=res, mod=mod):
+        permises = batch_find_permis(masks, words, engine)
+        # the few graphs left get a local search, then are searched exhaustively, up to automorphism
+        for g in np.flatnonzero(~np.any(permises, axis=1)):
+            M = adjacency_matrix(masks[g])
+            permises[g] = find_permis_annealing(M)
+            if not np.any(permises[g]):
+                permises[g] = find_permis(M, engine, automorphisms=True)
+        masks_blocks.append(masks.astype(bitmask_dtype(n)))
+        permises_blocks.append(permises)
+    masks = np.concatenate(masks_blocks) if masks_blocks else np.zeros((0, n), dtype=bitmask_dtype(n))
+    permises = np.concatenate(permises_blocks) if permises_blocks else np.zeros((0, n), dtype=np.uint8)
+    # the permises first, so a shard is only taken as done once both are saved
+    np.save(permises_path, permises)
+    np.save(masks_path, masks)
+    return res, len(permises), int(np.count_nonzero(~np.any(permises, axis=1)))
+
+
+def generated_permis_finder(n, processes=32, mod=None, engine=ENGINE_BITSLICED, tries=1000):
+    """
+    Finds a permis for every connected n vertex graph (or that there is none) without a graph6 file: each task
+    generates one shard of the graphs itself (see graph_generation.connected_graphs) and searches them as they come,
+    in blocks with batch_find_permis, then with find_permis_annealing and exhaustively for the graphs left. Shard res
+    is saved as masks_{res}.npy (the graphs, as neighbourhood bitmasks) and permises_{res}.npy in
+    permis_tables/generated_g{n}c/; a restarted run skips the shards already saved.
+    :param n: number of vertices
+    :param processes: number of worker processes
+    :param mod: number of shards, 16 per process by default
+    :param engine: one of the ENGINE_* constants
+    :param tries: how many random words are tried on every block, after the identity
+    """
+    print(f"\n--- Running generated permis finder with n={n}, {processes} processes ---")
+    if mod is None:
+        mod = 16 * processes
+    out_dir = f"permis_tables/generated_g{n}c"
+    os.makedirs(out_dir, exist_ok=True)
+    words = np.empty((tries + 1, n), dtype=np.uint8)
+    words[0] = np.arange(n)
+    for i in range(1, tries + 1):
+        words[i] = np.random.permutation(n)
+    start = perf_counter()
+    num_graphs = num_permisless = shards = 0
+    with Pool(processes=processes) as pool:
+        tasks = ((n, res, mod, words, engine, out_dir) for res in range(mod))
+        for res, graphs, permisless in pool.imap_unordered(_find_permises_of_generated_shard, tasks):
+            num_graphs += graphs
+            num_permisless += permisless
+            shards += 1
+            print(f"{perf_counter() - start:9.1f}s: {shards} of {mod} shards, {num_graphs} graphs")
+    print(f"Finished {num_graphs} {n} vertex graphs (of {oeis_A001349(n)}) in {perf_counter() - start:.3f} seconds,"
+          f" {num_permisless} graphs are permisless; {num_graphs - num_permisless} permises found")
+
+
 if __name__ == "__main__":
-    whp_processor(8)
-    whp_processor(9)
-    whp_processor(10)
-    # hybrid_permis_finder(10)
+    permis_cache = open_cache()
+    whp_processor(8, cache=permis_cache)
+    whp_processor(9, cache=permis_cache)
+    whp_processor(10, cache=permis_cache)
+    # hybrid_permis_finder(10, cache=permis_cache)
     print("Done in main.")
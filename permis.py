@@ -1,7 +1,51 @@
-from generators import shifty_bitstring_generator, ehrlich_permutation_generator
-from numba import njit
+from automorphisms import automorphism_group, is_orbit_representative
+from generators import shifty_bitstring_generator, ehrlich_star_transpositions, orbit_representative_generator, \
+    lexicographic_permutation_generator, factorial, unrank_permutation
+from numba import njit, prange
 import numpy as np
 
+# engines for deciding whether a word is a permis; pass one as the engine argument of the search functions below
+ENGINE_MATRIX = 0  # status as a uint8 array, neighbourhoods as rows of the adjacency matrix
+ENGINE_BITMASK = 1  # status as the bits of one integer, neighbourhoods as bitmasks
+ENGINE_VECTORIZED = 2  # all 2^n start statuses at once, one pass over an integer array per vertex update
+ENGINE_BITSLICED = 3  # 64 start statuses per np.uint64, one lane per start status
+
+# how many recently refuting start statuses the searches below try first on every word
+KILLER_CACHE_SIZE = 8
+
+# bit k of _LANE_PATTERNS[v] is bit v of k, i.e. the status of vertex v in the k-th start status of a block of 64
+_LANE_PATTERNS = np.array([0xAAAAAAAAAAAAAAAA, 0xCCCCCCCCCCCCCCCC, 0xF0F0F0F0F0F0F0F0,
+                           0xFF00FF00FF00FF00, 0xFFFF0000FFFF0000, 0xFFFFFFFF00000000], dtype=np.uint64)
+
+
+@njit
+def neighbourhood_bitmasks(M):
+    """
+    :param M: adjacency matrix of graph G
+    :return: np.array N of length n where bit u of N[v] is set iff u is adjacent to v
+    """
+    n = M.shape[0]
+    N = np.zeros(n, dtype=np.int64)
+    for v in range(n):
+        for u in range(n):
+            if M[v, u]:
+                N[v] |= np.int64(1) << u
+    return N
+
+
+@njit
+def adjacency_matrix(N):
+    """
+    :param N: neighbourhood bitmasks of graph G, as returned by neighbourhood_bitmasks
+    :return: the adjacency matrix of G
+    """
+    n = N.shape[0]
+    M = np.zeros((n, n), dtype=np.uint8)
+    for v in range(n):
+        for u in range(n):
+            M[v, u] = (N[v] >> u) & 1
+    return M
+
 
 @njit
 def is_permis(M, word):
@@ -21,79 +65,813 @@ def is_permis(M, word):
 
 
 @njit
-def permis_count(M: np.ndarray):
-    n = len(M)
+def refuting_state_matrix(M, word):
+    """
+    Same check as is_permis, but reports a start status which word fails on.
+    :param M: adjacency matrix of graph G
+    :param word: the word to check
+    :return: the first start status (as an integer, bit v for vertex v) from which word does not reach a fixed point,
+     or -1 if word is a permis for G
+    """
+    n = M.shape[0]
+    i = 0
+    for start_status in shifty_bitstring_generator(n):
+        refuting = i
+        i += 1
+        # do one "round" of updates on the vertex status
+        for vertex in word:
+            start_status[vertex] = 0
+            start_status[vertex] = int(not np.any(np.logical_and(M[vertex], start_status)))
+        # now check that the status vector is not updated on the second pass; if it is, then reject
+        for vertex in range(n):
+            if (start_status[vertex] == 0) and (not np.any(np.logical_and(M[vertex], start_status))):
+                # shifty_bitstring_generator puts bit n-1-v of i in position v; reverse to the bitmask convention
+                state = 0
+                for v in range(n):
+                    state |= ((refuting >> (n - 1 - v)) & 1) << v
+                return state
+    return -1
+
+
+@njit
+def refutes(N, word, start_status):
+    """
+    :param N: neighbourhood bitmasks of graph G, as returned by neighbourhood_bitmasks
+    :param word: the word to check
+    :param start_status: a start status as an integer, bit v for vertex v
+    :return: True if one pass of word from start_status does not reach a fixed point, False otherwise
+    """
+    status = start_status
+    # do one "round" of updates on the vertex status
+    for vertex in word:
+        bit = np.int64(1) << vertex
+        if status & N[vertex]:
+            status &= ~bit
+        else:
+            status |= bit
+    # reject if some vertex is zero and so are all of its neighbors
+    for vertex in range(N.shape[0]):
+        if not (status >> vertex) & 1 and not status & N[vertex]:
+            return True
+    return False
+
+
+@njit
+def refuting_state_bitmask(N, word):
+    """
+    Same check as is_permis, but the status of every vertex is held in one integer (bit v for vertex v), so a vertex
+    update is a single AND with its neighbourhood bitmask instead of a pass over a row of the adjacency matrix.
+    :param N: neighbourhood bitmasks of graph G, as returned by neighbourhood_bitmasks
+    :param word: the word to check
+    :return: the first start status from which word does not reach a fixed point, or -1 if word is a permis for G
+    """
+    for start_status in range(2 ** N.shape[0]):
+        if refutes(N, word, start_status):
+            return start_status
+    return -1
+
+
+@njit
+def refuting_state_vectorized(N, word, status):
+    """
+    Same check as refuting_state_bitmask, but the word is applied to all 2^n start statuses at once: status holds one
+    integer per start status, each vertex update is a single pass over that array, and the fixed point check is a
+    single reduction at the end. For n <= 12 the array fits comfortably in cache.
+    :param N: neighbourhood bitmasks of graph G, as returned by neighbourhood_bitmasks
+    :param word: the word to check
+    :param status: scratch np.array of 2^n np.int64, overwritten
+    :return: a start status from which word does not reach a fixed point, or -1 if word is a permis for G
+    """
+    n = N.shape[0]
+    num_states = status.shape[0]
+    for start_status in range(num_states):
+        status[start_status] = start_status
+    for vertex in word:
+        bit = np.int64(1) << vertex
+        neighbours = N[vertex]
+        for i in range(num_states):
+            s = status[i]
+            status[i] = (s & ~bit) | (bit * ((s & neighbours) == 0))
+    # a status is rejected if some vertex is zero and so are all of its neighbors
+    refuting = -1
+    for vertex in range(n):
+        closed_neighbourhood = N[vertex] | (np.int64(1) << vertex)
+        for i in range(num_states):
+            if (status[i] & closed_neighbourhood) == 0:
+                refuting = i
+    return refuting
+
+
+@njit
+def refuting_state_vectorized_from(N, word, states, valid):
+    """
+    Same check as refuting_state_vectorized, keeping the status of every start status after each update: states[d]
+    holds them after the first d vertices of word. Only the updates from position valid on are simulated, so a word
+    which agrees with the last word checked on its first valid vertices reuses that work.
+    :param N: neighbourhood bitmasks of graph G, as returned by neighbourhood_bitmasks
+    :param word: the word to check
+    :param states: scratch np.array of shape (n + 1, 2^n) np.int64, kept between calls
+    :param valid: how many leading rows of states are up to date for word; 0 on the first call
+    :return: a start status from which word does not reach a fixed point, or -1 if word is a permis for G
+    """
+    n = N.shape[0]
+    num_states = states.shape[1]
+    if valid == 0:
+        for start_status in range(num_states):
+            states[0, start_status] = start_status
+    for d in range(valid, n):
+        bit = np.int64(1) << word[d]
+        neighbours = N[word[d]]
+        for i in range(num_states):
+            s = states[d, i]
+            states[d + 1, i] = (s & ~bit) | (bit * ((s & neighbours) == 0))
+    # a status is rejected if some vertex is zero and so are all of its neighbors
+    refuting = -1
+    for vertex in range(n):
+        closed_neighbourhood = N[vertex] | (np.int64(1) << vertex)
+        for i in range(num_states):
+            if (states[n, i] & closed_neighbourhood) == 0:
+                refuting = i
+    return refuting
+
+
+@njit
+def refuting_state_bitsliced(N, word):
+    """
+    Same check as refuting_state_bitmask, but bit-sliced: lanes[v] holds the status of vertex v in 64 different start
+    statuses, so each vertex update is one OR over its neighbours' lanes followed by a NOT, simulating 64 start
+    statuses at once. The 2^n start statuses are processed in blocks of 64, stopping at the first block with a
+    rejected lane.
+    :param N: neighbourhood bitmasks of graph G, as returned by neighbourhood_bitmasks
+    :param word: the word to check
+    :return: the first start status from which word does not reach a fixed point, or -1 if word is a permis for G
+    """
+    n = N.shape[0]
+    lanes = np.empty(n, dtype=np.uint64)
+    all_lanes = ~np.uint64(0)
+    if n < 6:
+        # a single, partially filled block
+        num_blocks = 1
+        valid_lanes = (np.uint64(1) << np.uint64(2 ** n)) - np.uint64(1)
+    else:
+        num_blocks = 2 ** (n - 6)
+        valid_lanes = all_lanes
+    for block in range(num_blocks):
+        # lane k of this block is start status 64 * block + k
+        for vertex in range(n):
+            if vertex < 6:
+                lanes[vertex] = _LANE_PATTERNS[vertex]
+            elif (block >> (vertex - 6)) & 1:
+                lanes[vertex] = all_lanes
+            else:
+                lanes[vertex] = np.uint64(0)
+        # do one "round" of updates on the vertex status
+        for vertex in word:
+            dominated = np.uint64(0)
+            for neighbour in range(n):
+                if (N[vertex] >> neighbour) & 1:
+                    dominated |= lanes[neighbour]
+            lanes[vertex] = ~dominated
+        # a lane is rejected if some vertex is zero and so are all of its neighbors
+        rejected = np.uint64(0)
+        for vertex in range(n):
+            dominated = lanes[vertex]
+            for neighbour in range(n):
+                if (N[vertex] >> neighbour) & 1:
+                    dominated |= lanes[neighbour]
+            rejected |= ~dominated
+        rejected &= valid_lanes
+        if rejected:
+            lane = 0
+            while not (rejected >> np.uint64(lane)) & np.uint64(1):
+                lane += 1
+            return 64 * block + lane
+    return -1
+
+
+@njit
+def refuting_state_with(M, N, word, engine, status):
+    """
+    :param M: adjacency matrix of graph G
+    :param N: neighbourhood bitmasks of graph G
+    :param word: the word to check
+    :param engine: one of the ENGINE_* constants
+    :param status: scratch np.array of 2^n np.int64, used by ENGINE_VECTORIZED
+    :return: a start status (bit v for vertex v) from which word does not reach a fixed point, or -1 if word is a
+     permis for G
+    """
+    if engine == ENGINE_BITSLICED:
+        return refuting_state_bitsliced(N, word)
+    if engine == ENGINE_VECTORIZED:
+        return refuting_state_vectorized(N, word, status)
+    if engine == ENGINE_BITMASK:
+        return refuting_state_bitmask(N, word)
+    return refuting_state_matrix(M, word)
+
+
+@njit
+def is_permis_with(M, N, word, engine, status):
+    """
+    :param M: adjacency matrix of graph G
+    :param N: neighbourhood bitmasks of graph G
+    :param word: the word to check
+    :param engine: one of the ENGINE_* constants
+    :param status: scratch np.array of 2^n np.int64, used by ENGINE_VECTORIZED
+    :return: True if word is a permis for G, False otherwise
+    """
+    return refuting_state_with(M, N, word, engine, status) < 0
+
+
+@njit
+def is_permis_with_killers(M, N, word, engine, status, killers):
+    """
+    Same as is_permis_with, but first tries the "killer" start statuses which refuted recent words; most words are
+    refuted by a handful of start statuses, so a rejection usually costs a few single-status simulations rather than
+    a sweep. killers is kept in move-to-front order: a start status which refutes word is moved (or inserted) at the
+    front, evicting the least recently useful one.
+    :param killers: np.array of np.int64 start statuses, -1 for empty slots; updated in place
+    :return: True if word is a permis for G, False otherwise
+    """
+    if _killed(N, word, killers):
+        return False
+    refuting = refuting_state_with(M, N, word, engine, status)
+    if refuting < 0:
+        return True
+    _remember_killer(killers, refuting)
+    return False
+
+
+@njit
+def _killed(N, word, killers):
+    """
+    :return: True if one of killers refutes word, which is then moved to the front of killers
+    """
+    for i in range(killers.shape[0]):
+        killer = killers[i]
+        if killer < 0:
+            break
+        if refutes(N, word, killer):
+            for j in range(i, 0, -1):
+                killers[j] = killers[j - 1]
+            killers[0] = killer
+            return True
+    return False
+
+
+@njit
+def _remember_killer(killers, refuting):
+    size = killers.shape[0]
+    if size:
+        for j in range(size - 1, 0, -1):
+            killers[j] = killers[j - 1]
+        killers[0] = refuting
+
+
+@njit
+def _ehrlich_search(M, N, engine, killers, stop_at_first):
+    """
+    Checks every word, in Ehrlich order (see generators.ehrlich_star_transpositions), permuting a single buffer in
+    place. The buffer is read backwards, so the swap of its positions 0 and j only changes the last vertex and the
+    vertex at position n - 1 - j of the word, and with ENGINE_VECTORIZED the first n - 1 - j updates of the previous
+    word are reused (see refuting_state_vectorized_from); other engines check each word from scratch.
+    :param stop_at_first: if True, stop at the first permis
+    :return: (the number of permises found, the first permis if stop_at_first and there is one, else np.zeros(n))
+    """
+    n = M.shape[0]
+    buffer = np.arange(n, dtype=np.uint8)
+    word = buffer[::-1]
+    status = np.empty(2 ** n, dtype=np.int64)
+    states = np.empty((n + 1, 2 ** n if engine == ENGINE_VECTORIZED else 0), dtype=np.int64)
+    valid = 0
+    count = 0
+    for j in ehrlich_star_transpositions(buffer):
+        if j:
+            valid = min(valid, n - 1 - j)
+        if _killed(N, word, killers):
+            continue
+        if engine == ENGINE_VECTORIZED:
+            refuting = refuting_state_vectorized_from(N, word, states, valid)
+            valid = n
+        else:
+            refuting = refuting_state_with(M, N, word, engine, status)
+        if refuting >= 0:
+            _remember_killer(killers, refuting)
+            continue
+        count += 1
+        if stop_at_first:
+            return count, word.copy()
+    return count, np.zeros(n, dtype=np.uint8)
+
+
+@njit
+def batch_is_permis(masks, word, undecided, engine=ENGINE_BITSLICED):
+    """
+    Checks one word against a whole block of graphs.
+    :param masks: np.array of shape (num_graphs, n) of neighbourhood bitmasks, see graph_store.BitmaskGraphStack
+    :param word: the word to check
+    :param undecided: np.array of num_graphs bools; only these graphs are checked
+    :param engine: one of the ENGINE_* constants
+    :return: np.array of num_graphs bools, True where word is a permis for the graph (False for graphs not checked)
+    """
+    num_graphs, n = masks.shape
+    status = np.empty(2 ** n, dtype=np.int64)
+    passed = np.zeros(num_graphs, dtype=np.bool_)
+    for g in range(num_graphs):
+        if undecided[g]:
+            N = masks[g].astype(np.int64)
+            M = adjacency_matrix(N) if engine == ENGINE_MATRIX else np.empty((0, 0), dtype=np.uint8)
+            passed[g] = is_permis_with(M, N, word, engine, status)
+    return passed
+
+
+@njit
+def batch_find_permis(masks, words, engine=ENGINE_BITSLICED, killer_cache=KILLER_CACHE_SIZE):
+    """
+    Tries each of the given words, in order, on a whole block of graphs, one word at a time across the block; a graph
+    drops out as soon as a permis for it is found, and every graph keeps its own killer cache between words.
+    :param masks: np.array of shape (num_graphs, n) of neighbourhood bitmasks, see graph_store.BitmaskGraphStack
+    :param words: np.array of shape (num_words, n), e.g. the identity followed by random words
+    :param engine: one of the ENGINE_* constants
+    :param killer_cache: how many recently refuting start statuses to try first on every word, per graph
+    :return: np.array of shape (num_graphs, n), the first of the words which is a permis for each graph, or zeros
+     where none is
+    """
+    num_graphs, n = masks.shape
+    Ns = masks.astype(np.int64)
+    status = np.empty(2 ** n, dtype=np.int64)
+    killers = np.full((num_graphs, killer_cache), -1, dtype=np.int64)
+    permises = np.zeros((num_graphs, n), dtype=np.uint8)
+    decided = np.zeros(num_graphs, dtype=np.bool_)
+    for w in range(words.shape[0]):
+        word = words[w]
+        for g in range(num_graphs):
+            if decided[g]:
+                continue
+            M = adjacency_matrix(Ns[g]) if engine == ENGINE_MATRIX else np.empty((0, 0), dtype=np.uint8)
+            if is_permis_with_killers(M, Ns[g], word, engine, status, killers[g]):
+                permises[g] = word
+                decided[g] = True
+    return permises
+
+
+@njit
+def permis_count(M: np.ndarray, engine=ENGINE_MATRIX, killer_cache=KILLER_CACHE_SIZE, automorphisms=False,
+                 dfs=False):
+    """
+    :param M: adjacency matrix of graph G
+    :param engine: one of the ENGINE_* constants
+    :param killer_cache: how many recently refuting start statuses to try first on every word
+    :param automorphisms: if True, only count one word per orbit of Aut(G) and scale up by |Aut(G)|
+    :param dfs: if True, use prefix_search instead (engine and killer_cache are then ignored)
+    :return: the number of words which are a permis for G
+    """
+    if dfs:
+        return permis_count_dfs(M, automorphisms)[0]
+    n = M.shape[0]
+    N = neighbourhood_bitmasks(M)
+    status = np.empty(2 ** n, dtype=np.int64)
+    killers = np.full(killer_cache, -1, dtype=np.int64)
     count = 0
-    for word in ehrlich_permutation_generator(n):
-        if is_permis(M, word, n):
-            count += 1
-    return count
+    if automorphisms:
+        # relabelling a word by an automorphism preserves being a permis, and every orbit has |Aut(G)| words
+        autos = automorphism_group(M)
+        word = np.empty(n, dtype=np.uint8)
+        for _ in orbit_representative_generator(autos, word):
+            if is_permis_with_killers(M, N, word, engine, status, killers):
+                count += 1
+        return count * autos.shape[0]
+    return _ehrlich_search(M, N, engine, killers, False)[0]
 
 
 @njit
-def find_permis(M: np.ndarray):
+def find_permis(M: np.ndarray, engine=ENGINE_MATRIX, killer_cache=KILLER_CACHE_SIZE, automorphisms=False,
+                dfs=False):
     """
     :param M: adjacency matrix of graph G
+    :param engine: one of the ENGINE_* constants
+    :param killer_cache: how many recently refuting start statuses to try first on every word
+    :param automorphisms: if True, only try one word per orbit of Aut(G)
+    :param dfs: if True, use prefix_search instead (engine and killer_cache are then ignored)
     :return: np.array a permis for graph G if one exists, or np.zeros(n) otherwise.
     """
+    if dfs:
+        return find_permis_dfs(M, automorphisms)[0]
     n = M.shape[0]
-    for word in ehrlich_permutation_generator(n):
-        if is_permis(M, word):
-            return word.copy()
-    return np.zeros(n, dtype=np.uint8)
+    N = neighbourhood_bitmasks(M)
+    status = np.empty(2 ** n, dtype=np.int64)
+    killers = np.full(killer_cache, -1, dtype=np.int64)
+    if automorphisms:
+        word = np.empty(n, dtype=np.uint8)
+        for _ in orbit_representative_generator(automorphism_group(M), word):
+            if is_permis_with_killers(M, N, word, engine, status, killers):
+                return word.copy()
+        return np.zeros(n, dtype=np.uint8)
+    return _ehrlich_search(M, N, engine, killers, True)[1]
 
 
 @njit
-def find_permis_whp(M: np.ndarray, tries=1000):
+def find_permis_whp(M: np.ndarray, tries=1000, engine=ENGINE_MATRIX, killer_cache=KILLER_CACHE_SIZE):
     """
     Attempts to find a permis by trying ones chosen uniformly at random.
     :param tries: how many attempts should be made - typically 10<tries<5000
     :param M: adjacency matrix of graph G
+    :param engine: one of the ENGINE_* constants
+    :param killer_cache: how many recently refuting start statuses to try first on every word
     :return: np.array a permis for graph G if one exists, or np.zeros(n) otherwise.
     """
     n = M.shape[0]
+    N = neighbourhood_bitmasks(M)
+    status = np.empty(2 ** n, dtype=np.int64)
+    killers = np.full(killer_cache, -1, dtype=np.int64)
     word = np.arange(n, dtype=np.uint8)
-    if is_permis(M, word):
+    if is_permis_with_killers(M, N, word, engine, status, killers):
         return word
     for i in range(tries):
-        word = np.random.permutation(word)
-        if is_permis(M, word):
-            return word.copy()
+        np.random.shuffle(word)
+        if is_permis_with_killers(M, N, word, engine, status, killers):
+            return word
     return np.zeros(n, dtype=np.uint8)
 
 
 @njit
-def has_permis(M: np.ndarray):
+def failing_counterexamples_from(N, word, lanes, valid, used):
     """
+    Scores word by how many of a set of up to 64 chosen start statuses it fails on, bit-sliced as in
+    refuting_state_bitsliced: lanes[d, v] holds the status of vertex v in each of them after the first d updates of
+    word, so only the updates from position valid on are simulated.
+    :param N: neighbourhood bitmasks of graph G, as returned by neighbourhood_bitmasks
+    :param word: the word to score
+    :param lanes: np.array of shape (n + 1, n) np.uint64, lanes[0] holding the chosen start statuses; kept between calls
+    :param valid: how many leading rows of lanes are up to date for word, at least 1
+    :param used: np.uint64 bitmask of the lanes holding a chosen start status
+    :return: the number of chosen start statuses from which word does not reach a fixed point
+    """
+    n = N.shape[0]
+    for d in range(valid - 1, n):
+        vertex = word[d]
+        dominated = np.uint64(0)
+        for v in range(n):
+            lanes[d + 1, v] = lanes[d, v]
+            if (N[vertex] >> v) & 1:
+                dominated |= lanes[d, v]
+        lanes[d + 1, vertex] = ~dominated
+    # a lane is rejected if some vertex is zero and so are all of its neighbors
+    rejected = np.uint64(0)
+    for vertex in range(n):
+        dominated = lanes[n, vertex]
+        for neighbour in range(n):
+            if (N[vertex] >> neighbour) & 1:
+                dominated |= lanes[n, neighbour]
+        rejected |= ~dominated
+    rejected &= used
+    failing = 0
+    while rejected:
+        rejected &= rejected - np.uint64(1)
+        failing += 1
+    return failing
+
+
+@njit
+def find_permis_annealing(M: np.ndarray, steps=2000, start_temperature=1.0, end_temperature=0.1, restarts=10):
+    """
+    Local search for a permis by simulated annealing, guided by counterexamples: a word is scored by how many of the
+    start statuses which refuted earlier words it fails on (see failing_counterexamples_from), and when a word passes
+    all of them it is checked in full, becoming the answer or adding the start status it fails on to the
+    counterexamples (up to 64, the oldest replaced first). A move takes one vertex out of the word and inserts it
+    elsewhere (an adjacent transposition when the positions are next to each other); a move which does not raise the
+    score is always accepted, and one which raises it by delta with probability exp(-delta / temperature), the
+    temperature falling geometrically over the steps. A move between positions i < j leaves the first i updates
+    unchanged, so only the rest of the word is simulated again.
+    Meant for graphs which survive find_permis_whp but may have a permis: words next to a permis are often permises
+    too, and unlike independent random words the search stays near words which fail on few start statuses.
     :param M: adjacency matrix of graph G
+    :param steps: how many moves to try per restart
+    :param start_temperature: temperature at the first move, in start statuses
+    :param end_temperature: temperature at the last move
+    :param restarts: how many times to start again, from a uniformly random word after the first time
+    :return: np.array a permis for graph G if one is found, or np.zeros(n) otherwise.
+    """
+    return annealing_search(neighbourhood_bitmasks(M), steps, start_temperature, end_temperature, restarts)[0]
+
+
+@njit
+def annealing_search(N, steps, start_temperature, end_temperature, restarts):
+    """
+    The search of find_permis_annealing.
+    :param N: neighbourhood bitmasks of graph G, as returned by neighbourhood_bitmasks
+    :return: (a permis for G or np.zeros(n) if none was found, how many words were scored, how many were checked in
+     full)
+    """
+    n = N.shape[0]
+    lanes = np.zeros((n + 1, n), dtype=np.uint64)
+    used = np.uint64(0)
+    counterexamples = 0
+    word = np.arange(n, dtype=np.uint8)
+    cooling = (end_temperature / start_temperature) ** (1 / max(steps - 1, 1))
+    scored = 0
+    checked = 0
+    for restart in range(restarts):
+        if restart:
+            np.random.shuffle(word)
+        score = failing_counterexamples_from(N, word, lanes, 1, used)
+        scored += 1
+        valid = n + 1
+        temperature = start_temperature
+        for step in range(steps):
+            if score == 0:
+                checked += 1
+                refuting = refuting_state_bitsliced(N, word)
+                if refuting < 0:
+                    return word, scored, checked
+                # make the start status which refutes word a counterexample
+                lane = np.uint64(counterexamples % 64)
+                counterexamples += 1
+                for v in range(n):
+                    if (refuting >> v) & 1:
+                        lanes[0, v] |= np.uint64(1) << lane
+                    else:
+                        lanes[0, v] &= ~(np.uint64(1) << lane)
+                used |= np.uint64(1) << lane
+                score = failing_counterexamples_from(N, word, lanes, 1, used)
+                scored += 1
+                valid = n + 1
+            i = np.random.randint(n)
+            j = np.random.randint(n - 1)
+            if j >= i:
+                j += 1
+            # move the vertex at position i to position j
+            vertex = word[i]
+            if i < j:
+                for k in range(i, j):
+                    word[k] = word[k + 1]
+            else:
+                for k in range(i, j, -1):
+                    word[k] = word[k - 1]
+            word[j] = vertex
+            first = min(i, j)
+            new_score = failing_counterexamples_from(N, word, lanes, min(valid, first + 1), used)
+            scored += 1
+            valid = n + 1
+            if new_score <= score or np.random.random() < np.exp((score - new_score) / temperature):
+                score = new_score
+            else:
+                # undo the move; lanes now hold the rejected word after its first first updates
+                if i < j:
+                    for k in range(j, i, -1):
+                        word[k] = word[k - 1]
+                else:
+                    for k in range(j, i):
+                        word[k] = word[k + 1]
+                word[i] = vertex
+                valid = first + 1
+            temperature *= cooling
+        if score == 0 and refuting_state_bitsliced(N, word) < 0:
+            return word, scored, checked + 1
+    return np.zeros(n, dtype=np.uint8), scored, checked
+
+
+@njit
+def has_permis(M: np.ndarray, engine=ENGINE_MATRIX, killer_cache=KILLER_CACHE_SIZE, automorphisms=False,
+               dfs=False):
+    """
+    :param M: adjacency matrix of graph G
+    :param engine: one of the ENGINE_* constants
+    :param killer_cache: how many recently refuting start statuses to try first on every word
+    :param automorphisms: if True, only try one word per orbit of Aut(G)
+    :param dfs: if True, use prefix_search instead (engine and killer_cache are then ignored)
     :return: 1 if G admits a permis, 0 otherwise
     """
+    if dfs:
+        return int(has_permis_dfs(M, automorphisms)[0])
     n = M.shape[0]
-    for word in ehrlich_permutation_generator(n):
-        if is_permis(M, word):
-            return 1
-    return 0
+    N = neighbourhood_bitmasks(M)
+    status = np.empty(2 ** n, dtype=np.int64)
+    killers = np.full(killer_cache, -1, dtype=np.int64)
+    if automorphisms:
+        word = np.empty(n, dtype=np.uint8)
+        for _ in orbit_representative_generator(automorphism_group(M), word):
+            if is_permis_with_killers(M, N, word, engine, status, killers):
+                return 1
+        return 0
+    return int(_ehrlich_search(M, N, engine, killers, True)[0])
 
 
 @njit
-def has_permis_whp(M: np.ndarray, tries=1000):
+def has_permis_whp(M: np.ndarray, tries=1000, engine=ENGINE_MATRIX, killer_cache=KILLER_CACHE_SIZE):
     """
     Attempts to find a permis by trying ones chosen uniformly at random.
     :param tries: how many attempts should be made - typically 10<tries<5000
     :param M: adjacency matrix of graph G
+    :param engine: one of the ENGINE_* constants
+    :param killer_cache: how many recently refuting start statuses to try first on every word
     :return: 1 if G admits a permis, 0 otherwise
     """
     n = M.shape[0]
+    N = neighbourhood_bitmasks(M)
+    status = np.empty(2 ** n, dtype=np.int64)
+    killers = np.full(killer_cache, -1, dtype=np.int64)
     word = np.arange(n, dtype=np.uint8)
-    if is_permis(M, word):
+    if is_permis_with_killers(M, N, word, engine, status, killers):
         return 1
     for i in range(tries):
-        word = np.random.permutation(word)
-        if is_permis(M, word):
+        np.random.shuffle(word)
+        if is_permis_with_killers(M, N, word, engine, status, killers):
             return 1
     return 0
 
 
+@njit
+def prefix_search(N, autos, stop_at_first):
+    """
+    Depth-first search over word prefixes which shares work between words with a common prefix: states[d] holds the
+    status of every start status after the first d updates, so extending a prefix costs one vertex update over 2^n
+    start statuses, instead of re-simulating the whole word for every word as the Ehrlich order does. A subtree is
+    pruned as soon as some vertex and all of its neighbours have been updated (so none of them changes again) and in
+    some start status they are all zero, because then no completion of the prefix is a permis.
+    Only prefixes whose last vertex is smallest in its orbit under the automorphisms in autos fixing the rest of the
+    prefix are extended, as in orbit_representative_generator; pass just the identity to search every word.
+    :param N: neighbourhood bitmasks of graph G, as returned by neighbourhood_bitmasks
+    :param autos: np.array of shape (k, n), the automorphism group of G or a subgroup of it
+    :param stop_at_first: if True, stop at the first permis found
+    :return: (number of orbit representative permises found, first permis found or np.zeros(n), nodes visited)
+    """
+    k, n = autos.shape
+    num_states = 2 ** n
+    states = np.empty((n + 1, num_states), dtype=np.int64)
+    for start_status in range(num_states):
+        states[0, start_status] = start_status
+    updated = np.zeros(n + 1, dtype=np.int64)  # updated[d] is the bitmask of the first d vertices of word
+    word = np.zeros(n, dtype=np.uint8)
+    first = np.zeros(n, dtype=np.uint8)
+    used = np.zeros(n, dtype=np.bool_)
+    alive = np.ones((n + 1, k), dtype=np.bool_)
+    next_candidate = np.zeros(n + 1, dtype=np.int64)
+    count = 0
+    nodes = 0
+    depth = 0
+    while depth >= 0:
+        if depth == n:
+            # every vertex passed the check when its closed neighbourhood was completed, so word is a permis
+            if count == 0:
+                first[:] = word
+            count += 1
+            if stop_at_first:
+                break
+            depth -= 1
+            used[word[depth]] = False
+            continue
+        v = next_candidate[depth]
+        if v == n:
+            next_candidate[depth] = 0
+            depth -= 1
+            if depth >= 0:
+                used[word[depth]] = False
+            continue
+        next_candidate[depth] = v + 1
+        if used[v]:
+            continue
+        smallest_in_orbit = True
+        for a in range(k):
+            if alive[depth, a] and autos[a, v] < v:
+                smallest_in_orbit = False
+                break
+        if not smallest_in_orbit:
+            continue
+        nodes += 1
+        bit = np.int64(1) << v
+        neighbours = N[v]
+        for i in range(num_states):
+            s = states[depth, i]
+            states[depth + 1, i] = (s & ~bit) | (bit * ((s & neighbours) == 0))
+        updated[depth + 1] = updated[depth] | bit
+        # vertices whose closed neighbourhood has just been completed by v are final; check them
+        doomed = False
+        for u in range(n):
+            closed_neighbourhood = N[u] | (np.int64(1) << u)
+            if not (closed_neighbourhood >> v) & 1 or closed_neighbourhood & ~updated[depth + 1]:
+                continue
+            for i in range(num_states):
+                if (states[depth + 1, i] & closed_neighbourhood) == 0:
+                    doomed = True
+                    break
+            if doomed:
+                break
+        if doomed:
+            continue
+        word[depth] = v
+        used[v] = True
+        for a in range(k):
+            alive[depth + 1, a] = alive[depth, a] and autos[a, v] == v
+        depth += 1
+    return count, first, nodes
+
+
+@njit
+def _search_group(M, automorphisms):
+    if automorphisms:
+        return automorphism_group(M)
+    return np.arange(M.shape[0], dtype=np.uint8).reshape(1, M.shape[0])
+
+
+@njit
+def find_permis_dfs(M: np.ndarray, automorphisms=False):
+    """
+    :param M: adjacency matrix of graph G
+    :param automorphisms: if True, only try one word per orbit of Aut(G)
+    :return: (np.array a permis for graph G if one exists or np.zeros(n) otherwise, search nodes visited)
+    """
+    count, first, nodes = prefix_search(neighbourhood_bitmasks(M), _search_group(M, automorphisms), True)
+    return first, nodes
+
+
+@njit
+def has_permis_dfs(M: np.ndarray, automorphisms=False):
+    """
+    :param M: adjacency matrix of graph G
+    :param automorphisms: if True, only try one word per orbit of Aut(G)
+    :return: (1 if G admits a permis and 0 otherwise, search nodes visited)
+    """
+    count, first, nodes = prefix_search(neighbourhood_bitmasks(M), _search_group(M, automorphisms), True)
+    return min(count, 1), nodes
+
+
+@njit
+def permis_count_dfs(M: np.ndarray, automorphisms=False):
+    """
+    :param M: adjacency matrix of graph G
+    :param automorphisms: if True, only count one word per orbit of Aut(G) and scale up by |Aut(G)|
+    :return: (the number of words which are a permis for G, search nodes visited)
+    """
+    autos = _search_group(M, automorphisms)
+    count, first, nodes = prefix_search(neighbourhood_bitmasks(M), autos, False)
+    return count * autos.shape[0], nodes
+
+
+@njit
+def find_permis_rank_in_range(M: np.ndarray, start, stop, autos, engine=ENGINE_MATRIX, killer_cache=KILLER_CACHE_SIZE):
+    """
+    Searches the words with lexicographic rank in range(start, stop), so that one graph's n! words can be split
+    between several workers.
+    :param M: adjacency matrix of graph G
+    :param start: rank of the first word tried
+    :param stop: rank one past the last word tried
+    :param autos: np.array of shape (k, n); only words which are orbit representatives under it are tried. Pass the
+     automorphism group of G to search up to automorphism, or just the identity to try every word
+    :param engine: one of the ENGINE_* constants
+    :param killer_cache: how many recently refuting start statuses to try first on every word
+    :return: the rank of the first permis for graph G in the range if one exists (see unrank_permutation), or -1
+     otherwise.
+    """
+    n = M.shape[0]
+    N = neighbourhood_bitmasks(M)
+    status = np.empty(2 ** n, dtype=np.int64)
+    killers = np.full(killer_cache, -1, dtype=np.int64)
+    check_orbits = autos.shape[0] > 1
+    word = np.empty(n, dtype=np.uint8)
+    for rank in lexicographic_permutation_generator(word, start, stop):
+        if not (check_orbits and not is_orbit_representative(word, autos)):
+            if is_permis_with_killers(M, N, word, engine, status, killers):
+                return rank
+    return -1
+
+
+@njit(parallel=True)
+def find_permis_parallel(M: np.ndarray, num_ranges=64, engine=ENGINE_MATRIX, automorphisms=False, block=4096):
+    """
+    Splits the n! words of G into num_ranges rank ranges and searches them on numba's threads. Every range checks a
+    shared flag between blocks of words and gives up once some range has found a permis.
+    :param M: adjacency matrix of graph G
+    :param num_ranges: number of rank ranges, typically a few times the number of threads
+    :param engine: one of the ENGINE_* constants
+    :param automorphisms: if True, only try one word per orbit of Aut(G)
+    :param block: how many words are tried between checks of the shared flag
+    :return: np.array a permis for graph G if one exists, or np.zeros(n) otherwise.
+    """
+    n = M.shape[0]
+    total = factorial(n)
+    if automorphisms:
+        autos = automorphism_group(M)
+    else:
+        autos = np.arange(n, dtype=np.uint8).reshape(1, n)
+    found = np.zeros(1, dtype=np.int64)
+    ranks = np.full(num_ranges, -1, dtype=np.int64)
+    for r in prange(num_ranges):
+        stop = total * (r + 1) // num_ranges
+        block_start = total * r // num_ranges
+        while block_start < stop and not found[0]:
+            block_stop = min(stop, block_start + block)
+            rank = find_permis_rank_in_range(M, block_start, block_stop, autos, engine)
+            if rank >= 0:
+                ranks[r] = rank
+                found[0] = 1
+                break
+            block_start = block_stop
+    for r in range(num_ranges):
+        if ranks[r] >= 0:
+            return unrank_permutation(ranks[r], n)
+    return np.zeros(n, dtype=np.uint8)
+
+
 @njit  # todo: implement in such a way that parallelism isn't squandered - atm everyone waits for the permisless graph
 def has_permis_hybrid_BAD(M):
     """
@@ -0,0 +1,174 @@
+import os
+import sqlite3
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from automorphisms import canonical_form
+from g6_reader import numpy_adjmatrix_to_g6_bytes
+from permis import find_permis, find_permis_whp, has_permis, permis_count, ENGINE_MATRIX
+
+# has_permis is 0 or 1; permis is a witness in the labels of the graph looked up, or None if permisless or not stored;
+# count is the number of permises, or None if not known
+CachedResult = namedtuple("CachedResult", ["has_permis", "permis", "count"])
+
+# keys are graph6 in its short form, which only encodes up to 62 vertices; larger graphs are never cached
+MAX_CACHED_VERTICES = 62
+
+# one cache per path in each process, so that unpickling a cache in a pool worker reuses its connection and LRU
+_open_caches = {}
+
+
+def open_cache(path="permis_cache.sqlite", lru_size=1 << 16):
+    """
+    :return: this process's PermisCache for path, creating it on first use
+    """
+    if path not in _open_caches:
+        _open_caches[path] = PermisCache(path, lru_size)
+    return _open_caches[path]
+
+
+class PermisCache:
+    """
+    Persistent permis results, shared by every run and every process: a sqlite database in WAL mode (readers never block
+    and concurrent writers from pool workers just queue on the lock), keyed by the canonical graph6 of the graph so any
+    relabelling of a solved graph is a hit. A bounded LRU of recent entries sits in front of it.
+    Witness permises are stored in canonical labels and translated to the labels of the graph looked up.
+    Getting the key costs a canonical labelling (see automorphisms.canonical_labelling), which does not list the
+    automorphism group: under a millisecond even for K16 or an 11 vertex star, well below a search from 8 vertices on.
+    Graphs with more than MAX_CACHED_VERTICES vertices are never cached: lookup misses and store does nothing.
+    """
+
+    def __init__(self, path="permis_cache.sqlite", lru_size=1 << 16):
+        self.path = path
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._connection = None
+        self._pid = None
+
+    def __reduce__(self):
+        return open_cache, (self.path, self.lru_size)
+
+    def _connect(self):
+        # a connection must not cross a fork, so reconnect in a new process
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=600, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS results (graph6 BLOB PRIMARY KEY, "
+                                     "has_permis INTEGER NOT NULL, permis BLOB, count INTEGER)")
+            self._pid = os.getpid()
+            self._lru.clear()
+        return self._connection
+
+    def _remember(self, key, row):
+        self._lru[key] = row
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _row(self, key):
+        connection = self._connect()
+        if key in self._lru:
+            self._lru.move_to_end(key)
+            return self._lru[key]
+        row = connection.execute("SELECT has_permis, permis, count FROM results WHERE graph6 = ?", (key,)).fetchone()
+        if row is not None:
+            self._remember(key, row)
+        return row
+
+    @staticmethod
+    def _key(M):
+        """
+        :return: (key, labelling), the canonical graph6 of G and the labelling taking G to its canonical form, or
+         (None, None) if G is too large to cache
+        """
+        if M.shape[0] > MAX_CACHED_VERTICES:
+            return None, None
+        C, labelling = canonical_form(M)
+        return numpy_adjmatrix_to_g6_bytes(C), labelling
+
+    def lookup(self, M):
+        """
+        :param M: adjacency matrix of graph G
+        :return: CachedResult for G, or None if G has not been stored or has more than MAX_CACHED_VERTICES vertices
+        """
+        key, labelling = self._key(M)
+        if key is None:
+            return None
+        row = self._row(key)
+        if row is None:
+            return None
+        has_permis_, permis, count = row
+        if permis is not None:
+            # canonical label -> vertex of G
+            permis = np.argsort(labelling)[np.frombuffer(permis, dtype=np.uint8)].astype(np.uint8)
+        return CachedResult(has_permis_, permis, count)
+
+    def store(self, M, has_permis_, permis=None, count=None):
+        """
+        Records what is known about G, keeping anything already stored that this does not provide. Does nothing if G
+        has more than MAX_CACHED_VERTICES vertices.
+        :param M: adjacency matrix of graph G
+        :param has_permis_: 1 if G has a permis, 0 otherwise
+        :param permis: a permis for G, or None
+        :param count: number of permises of G, or None
+        """
+        key, labelling = self._key(M)
+        if key is None:
+            return
+        if permis is not None:
+            permis = labelling[permis].astype(np.uint8).tobytes()
+        connection = self._connect()
+        connection.execute("INSERT INTO results VALUES (?, ?, ?, ?) ON CONFLICT(graph6) DO UPDATE SET "
+                           "permis = COALESCE(results.permis, excluded.permis), "
+                           "count = COALESCE(results.count, excluded.count)",
+                           (key, int(has_permis_), permis, None if count is None else int(count)))
+        self._lru.pop(key, None)
+
+    def find_permis(self, M, engine=ENGINE_MATRIX, **kwargs):
+        """
+        Cached permis.find_permis.
+        """
+        cached = self.lookup(M)
+        if cached is not None and (cached.permis is not None or not cached.has_permis):
+            return cached.permis if cached.has_permis else np.zeros(M.shape[0], dtype=np.uint8)
+        permis = find_permis(M, engine, **kwargs)
+        found = bool(np.any(permis))
+        self.store(M, found, permis if found else None, None if found else 0)
+        return permis
+
+    def find_permis_whp(self, M, tries=1000, engine=ENGINE_MATRIX, **kwargs):
+        """
+        Cached permis.find_permis_whp: a graph known to the cache gets its stored answer, whether a permis or a proof
+        that there is none, and only a permis found is stored, as not finding one proves nothing.
+        """
+        cached = self.lookup(M)
+        if cached is not None and (cached.permis is not None or not cached.has_permis):
+            return cached.permis if cached.has_permis else np.zeros(M.shape[0], dtype=np.uint8)
+        permis = find_permis_whp(M, tries, engine, **kwargs)
+        if np.any(permis):
+            self.store(M, 1, permis)
+        return permis
+
+    def has_permis(self, M, engine=ENGINE_MATRIX, **kwargs):
+        """
+        Cached permis.has_permis.
+        """
+        cached = self.lookup(M)
+        if cached is not None:
+            return cached.has_permis
+        result = has_permis(M, engine, **kwargs)
+        self.store(M, result, count=None if result else 0)
+        return result
+
+    def permis_count(self, M, engine=ENGINE_MATRIX, **kwargs):
+        """
+        Cached permis.permis_count.
+        """
+        cached = self.lookup(M)
+        if cached is not None and cached.count is not None:
+            return cached.count
+        count = permis_count(M, engine, **kwargs)
+        self.store(M, count > 0, count=count)
+        return count
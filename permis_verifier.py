@@ -1,61 +1,99 @@
-import networkx as nx
 import numpy as np
-from matplotlib import pyplot as plt
 
-from permis import is_permis, find_permis_whp
-from g6_reader import graph6_to_numpy_stack
+from permis import is_permis_with, find_permis_whp, neighbourhood_bitmasks, adjacency_matrix, ENGINE_BITMASK
+from g6_reader import Graph6Stack
 from numba import njit
-from graph_utils import has_induced_c_k, is_cycle
+from permisless_features import permisless_feature_table
+from table_io import load_permis_table
 
 
-def verify_permises_for(n):
-    permises = np.load(f"permis_tables/permises_for_g{n}c.npy")
-    adj_matrices = graph6_to_numpy_stack(f"./geng_outputs/graph{n}c.g6")
-    return verify_permises(adj_matrices, permises, n)
+def verify_permises_for(n, engine=ENGINE_BITMASK, cache=None, indices=None):
+    """
+    :param cache: a PermisCache; if given, the graphs whose row is rejected (which includes every permisless row, as
+     an all zero row is never a permis) are looked up in it before any search for a permis the table is missing
+    :param indices: np.array of the indices of the graphs to re-check, or None for all of them; only those graphs are
+     read, so re-checking a few costs time in proportion to how few
+    """
+    permises = load_permis_table(n)
+    stack = Graph6Stack(f"./geng_outputs/graph{n}c.g6")
+    count = 0
+    if indices is not None:
+        count += verify_permises_bitmasks(stack.bitmasks(indices), permises[indices], n, engine, cache)
+    else:
+        # decode the graphs a block at a time, straight to bitmasks, rather than materializing the whole stack
+        block = 1 << 16
+        for first in range(0, len(stack), block):
+            masks = stack.bitmasks(slice(first, first + block))
+            count += verify_permises_bitmasks(masks, permises[first:first + len(masks)], n, engine, cache)
+    if indices is not None:
+        print("Verified", len(indices), n, "vertex graphs")
+    else:
+        print("Verified all", n, "vertex graphs")
+    return count
 
 
 @njit
-def verify_permises(adj_matrices, permises, n):
+def verify_permises(adj_matrices, permises, n, engine=ENGINE_BITMASK):
     count = 0
+    status = np.empty(2 ** n, dtype=np.int64)
     for adj_matrix, permis in zip(adj_matrices, permises):
-        if not is_permis(adj_matrix, permis):
+        if not is_permis_with(adj_matrix, neighbourhood_bitmasks(adj_matrix), permis, engine, status):
             print("Rejected permis number", count, ":", permis)
-            impossible_permis = find_permis_whp(adj_matrix, tries=500)
+            impossible_permis = find_permis_whp(adj_matrix, 500, engine)
             if np.any(impossible_permis):
                 print("Lies????")
                 print(impossible_permis)
                 print(adj_matrix)
             count += 1
-    print("Verified all", n, "vertex graphs")
+    return count
 
 
-def verify_induced_odd_holes_and_antiholes(n):
-    permises = np.load(f"permis_tables/permises_for_g{n}c.npy")
-    adj_matrices = graph6_to_numpy_stack(f"./geng_outputs/graph{n}c.g6")
-    count = 0
-    id = 0
-    for adj_matrix, permis in zip(adj_matrices, permises):
-        if not np.any(permis):
-            complement_adj_matrix = np.ones_like(adj_matrix) - adj_matrix - np.eye(n, dtype=np.uint8)
-            perfect = True
-            for k in [5, 7, 9]:
-                if has_induced_c_k(complement_adj_matrix, k):
-                    print(f"Graph {count} (id {id}) with no permis has an induced anti-C_{k}")
-                    perfect = False
-                if has_induced_c_k(adj_matrix, k):
-                    print(f"Graph {count} (id {id}) with no permis has an induced C_{k}")
-                    perfect = False
+@njit
+def rejected_rows_bitmasks(masks, permises, n, engine=ENGINE_BITMASK):
+    """
+    :return: np.array of the indices of the rows of permises which are not a permis for their graph, given as
+     neighbourhood bitmasks
+    """
+    rejected = np.zeros(masks.shape[0], dtype=np.bool_)
+    status = np.empty(2 ** n, dtype=np.int64)
+    for i in range(masks.shape[0]):
+        N = masks[i].astype(np.int64)
+        rejected[i] = not is_permis_with(adjacency_matrix(N), N, permises[i], engine, status)
+    return np.flatnonzero(rejected)
 
-            if perfect:
-                print(f"Graph {count} (id {id}) with no permis is perfect!! ------------------------------")
-                G = nx.from_numpy_array(adj_matrix)
-                nx.draw(G)
-                plt.savefig(f"./py_outputs/permisless_perfect_graphs/{n}_vertex_permisless_perfect_graph_{id}.png")
-                plt.show()
-            print()
-            count += 1
-        id += 1
-    print(f"Total {count} permisless {n} vertex graphs.")
+
+def verify_permises_bitmasks(masks, permises, n, engine=ENGINE_BITMASK, cache=None):
+    """
+    Same as verify_permises, for graphs given as neighbourhood bitmasks (see graph_store.BitmaskGraphStack).
+    :param cache: a PermisCache to answer the rejected graphs from before searching them, or None
+    """
+    rejected = rejected_rows_bitmasks(masks, permises, n, engine)
+    for count, i in enumerate(rejected):
+        print("Rejected permis number", count, ":", permises[i])
+        adj_matrix = adjacency_matrix(masks[i].astype(np.int64))
+        if cache is None:
+            impossible_permis = find_permis_whp(adj_matrix, 500, engine)
+        else:
+            impossible_permis = cache.find_permis_whp(adj_matrix, 500, engine)
+        if np.any(impossible_permis):
+            print("Lies????")
+            print(impossible_permis)
+            print(adj_matrix)
+    return len(rejected)
+
+
+def verify_induced_odd_holes_and_antiholes(n):
+    features = permisless_feature_table(n)
+    for count, row in enumerate(features.itertuples()):
+        if row.odd_antihole:
+            print(f"Graph {count} (id {row.Graph_i}) with no permis has an induced anti-C_{row.odd_antihole}")
+        if row.odd_hole:
+            print(f"Graph {count} (id {row.Graph_i}) with no permis has an induced C_{row.odd_hole}")
+        if row.perfect:
+            print(f"Graph {count} (id {row.Graph_i}) with no permis is perfect!! ------------------------------")
+        print()
+    print(f"Total {len(features)} permisless {n} vertex graphs.")
+    # drawing the perfect ones is a separate stage, see permisless_features.draw_permisless_perfect_graphs
 
 
 if __name__ == '__main__':
@@ -0,0 +1,222 @@
+import numpy as np
+import pandas as pd
+from numba import njit, prange
+
+from automorphisms import automorphism_group
+from g6_reader import Graph6Stack, encode_graph6_block_bitmasks
+from graph_utils import has_induced_cycle, complement_bitmasks
+from graph_generation import _connected_without
+from permis import adjacency_matrix
+from table_io import load_permis_table, permisless_indices
+
+FEATURES = ("edges", "min_degree", "max_degree", "triangles", "bipartite", "diameter", "cut_vertices", "true_twins",
+            "false_twins", "independence_number", "clique_number", "maximal_independent_sets", "odd_hole",
+            "odd_antihole", "perfect", "automorphisms")
+
+
+@njit
+def _popcount(x):
+    count = 0
+    while x:
+        x &= x - 1
+        count += 1
+    return count
+
+
+@njit
+def _independence_number(N, candidates):
+    """
+    :return: the size of a largest independent set of G within the vertices of the bitmask candidates
+    """
+    if not candidates:
+        return 0
+    v = 0
+    while not (candidates >> v) & 1:
+        v += 1
+    rest = candidates & ~(1 << v)
+    # either v is in the set, and its neighbours are not, or it is not
+    with_v = 1 + _independence_number(N, rest & ~N[v])
+    if not N[v] & rest:
+        # v has no neighbours left, so it may as well be in the set
+        return with_v
+    return max(with_v, _independence_number(N, rest))
+
+
+@njit
+def _shortest_induced_odd_cycle(N):
+    """
+    :return: the length of a shortest odd hole (induced odd cycle of length at least 5) of G, or 0 if it has none
+    """
+    for k in range(5, N.shape[0] + 1, 2):
+        if has_induced_cycle(N, k):
+            return k
+    return 0
+
+
+@njit
+def _features(N):
+    n = N.shape[0]
+    everyone = (1 << n) - 1
+    out = np.zeros(len(FEATURES) - 1, dtype=np.int64)
+    degrees = np.zeros(n, dtype=np.int64)
+    for v in range(n):
+        degrees[v] = _popcount(N[v])
+    out[0] = degrees.sum() // 2
+    out[1] = degrees.min()
+    out[2] = degrees.max()
+    triangles = 0
+    for v in range(n):
+        for u in range(v + 1, n):
+            if (N[v] >> u) & 1:
+                triangles += _popcount(N[v] & N[u] & ~((1 << (u + 1)) - 1))
+    out[3] = triangles
+    # bipartite: 2-colour by BFS layers; diameter: the largest eccentricity (G is connected)
+    bipartite = True
+    diameter = 0
+    for source in range(n):
+        seen = 1 << source
+        frontier = seen
+        layers = 0
+        while True:
+            reached = 0
+            for u in range(n):
+                if (frontier >> u) & 1:
+                    reached |= N[u]
+            if source == 0 and reached & frontier:
+                # an edge within a BFS layer closes an odd cycle
+                bipartite = False
+            frontier = reached & ~seen
+            if not frontier:
+                break
+            seen |= frontier
+            layers += 1
+        diameter = max(diameter, layers)
+    out[4] = bipartite
+    out[5] = diameter
+    for v in range(n):
+        out[6] += not _connected_without(N, n, v)
+    for v in range(n):
+        for u in range(v + 1, n):
+            out[7] += (N[v] | (1 << v)) == (N[u] | (1 << u))
+            out[8] += N[v] == N[u]
+    complement = complement_bitmasks(N)
+    out[9] = _independence_number(N, everyone)
+    out[10] = _independence_number(complement, everyone)
+    maximal = 0
+    for S in range(1, 1 << n):
+        independent = True
+        dominated = S
+        for v in range(n):
+            if (S >> v) & 1:
+                if N[v] & S:
+                    independent = False
+                    break
+                dominated |= N[v]
+        maximal += independent and dominated == everyone
+    out[11] = maximal
+    out[12] = _shortest_induced_odd_cycle(N)
+    out[13] = _shortest_induced_odd_cycle(complement)
+    out[14] = out[12] == 0 and out[13] == 0
+    return out
+
+
+@njit(parallel=True)
+def batch_features(masks):
+    """
+    :param masks: np.array of shape (num_graphs, n) of neighbourhood bitmasks of connected graphs
+    :return: np.array of shape (num_graphs, len(FEATURES)), one row of features per graph (see feature_table)
+    """
+    out = np.zeros((masks.shape[0], len(FEATURES)), dtype=np.int64)
+    for g in prange(masks.shape[0]):
+        N = masks[g].astype(np.int64)
+        out[g, :-1] = _features(N)
+        out[g, -1] = automorphism_group(adjacency_matrix(N)).shape[0]
+    return out
+
+
+def feature_table(masks, indices):
+    """
+    Structural features of a stack of connected graphs: edge count, min and max degree, triangle count, bipartiteness,
+    diameter, number of cut vertices, numbers of true and false twin pairs, independence and clique numbers, number of
+    maximal independent sets, the length of a shortest odd hole and odd antihole (0 if none), perfection and the order
+    of the automorphism group.
+    :param masks: np.array of shape (num_graphs, n) of neighbourhood bitmasks, n <= 16
+    :param indices: np.array of the indices of the graphs in their graph6 file
+    :return: pandas.DataFrame with one row per graph: Graph_i, graph6, then one column per feature
+    """
+    df = pd.DataFrame(batch_features(masks), columns=list(FEATURES))
+    for column in ["bipartite", "perfect"]:
+        df[column] = df[column].astype(bool)
+    df.insert(0, "graph6", [row.tobytes().decode() for row in encode_graph6_block_bitmasks(masks)])
+    df.insert(0, "Graph_i", indices)
+    return df
+
+
+def permisless_feature_table(n, path=None):
+    """
+    Computes the features of every permisless connected n vertex graph (see feature_table), reading only those graphs
+    from the graph6 file, and saves them as a CSV file for the plotting stage and later analysis.
+    :param n: number of vertices
+    :param path: where to save the table, py_outputs/permisless_features_graph{n}c.csv by default
+    :return: the table, as a pandas.DataFrame
+    """
+    if path is None:
+        path = f"py_outputs/permisless_features_graph{n}c.csv"
+    indices = permisless_indices(load_permis_table(n))
+    masks = Graph6Stack(f"./geng_outputs/graph{n}c.g6").bitmasks(indices)
+    df = feature_table(masks, indices)
+    df.to_csv(path, index=False)
+    print(f"Saved the features of {len(df)} permisless {n} vertex graphs to {path}")
+    return df
+
+
+def plot_feature_table(n, path=None, show=False):
+    """
+    Plotting stage, separate from the computation: a histogram of every feature of the permisless n vertex graphs, as
+    saved by permisless_feature_table, in plots/permisless_features_graph{n}c.png.
+    """
+    from matplotlib import pyplot as plt
+    if path is None:
+        path = f"py_outputs/permisless_features_graph{n}c.csv"
+    df = pd.read_csv(path)
+    columns = 4
+    rows = -(-len(FEATURES) // columns)
+    fig, axes = plt.subplots(rows, columns, figsize=(4 * columns, 3 * rows))
+    for ax, feature in zip(axes.flat, FEATURES):
+        counts = df[feature].astype(int).value_counts().sort_index()
+        ax.bar(counts.index.astype(str), counts.values, edgecolor="black")
+        ax.set_title(feature)
+    for ax in axes.flat[len(FEATURES):]:
+        ax.set_visible(False)
+    fig.suptitle(f"Features of the {len(df)} permisless {n}-vertex graphs")
+    fig.tight_layout()
+    fig.savefig(f"plots/permisless_features_graph{n}c.png")
+    if show:
+        plt.show()
+
+
+def draw_permisless_perfect_graphs(n, path=None, show=False):
+    """
+    Plotting stage: draws every perfect permisless n vertex graph in the table saved by permisless_feature_table to
+    py_outputs/permisless_perfect_graphs/.
+    """
+    import networkx as nx
+    from matplotlib import pyplot as plt
+    if path is None:
+        path = f"py_outputs/permisless_features_graph{n}c.csv"
+    df = pd.read_csv(path)
+    stack = Graph6Stack(f"./geng_outputs/graph{n}c.g6")
+    for id in df.loc[df["perfect"], "Graph_i"]:
+        plt.figure()
+        nx.draw(nx.from_numpy_array(stack[id]))
+        plt.savefig(f"./py_outputs/permisless_perfect_graphs/{n}_vertex_permisless_perfect_graph_{id}.png")
+        if show:
+            plt.show()
+        plt.close()
+
+
+if __name__ == "__main__":
+    for n in range(7, 10):
+        permisless_feature_table(n)
+        plot_feature_table(n)
+        draw_permisless_perfect_graphs(n)
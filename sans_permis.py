@@ -39,9 +39,22 @@ def good_under_perm(G, perm):
     return True
 
 
-def classify_atlas():
+def classify_atlas(cache=None):
+    """
+    :param cache: a permis_cache.PermisCache to take known results from, or None to decide every graph here, as the
+     computer proof does
+    """
     for G in nx.graph_atlas_g():
-        G_good, witness = is_good(G)
+        # the atlas starts with the empty graph, which has no canonical form
+        use_cache = cache is not None and len(G)
+        M = nx.to_numpy_array(G, dtype=np.uint8)
+        cached = cache.lookup(M) if use_cache else None
+        if cached is not None and (cached.permis is not None or not cached.has_permis):
+            G_good, witness = bool(cached.has_permis), cached.permis
+        else:
+            G_good, witness = is_good(G)
+            if use_cache:
+                cache.store(M, G_good, None if witness is None else np.array(witness))
         if G_good:
             print("Graph", G, "has permis", witness)
         else:
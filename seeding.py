@@ -0,0 +1,95 @@
+import numpy as np
+
+from automorphisms import canonical_form
+from g6_reader import Graph6Stack, numpy_adjmatrix_to_g6_bytes
+from permis import ENGINE_BITSLICED, KILLER_CACHE_SIZE, neighbourhood_bitmasks, is_permis_with_killers
+from table_io import load_permis_table, permis_table_exists, iter_blocks
+
+
+def parent_permis_index(n):
+    """
+    Indexes the stored permises of the connected n vertex graphs by canonical form, so the permis of any graph
+    isomorphic to one of them can be looked up without knowing its position in the table.
+    :param n: number of vertices; the permis table for n vertices must exist (see load_permis_table)
+    :return: dict from the canonical graph6 bytes of a graph to its permis in canonical labels, for graphs with a permis
+    """
+    stack = Graph6Stack(f"./geng_outputs/graph{n}c.g6")
+    permis_table = load_permis_table(n)
+    index = {}
+    for first, Ms in stack.blocks():
+        for M, permis in zip(Ms, permis_table[first:first + len(Ms)]):
+            if not np.any(permis):
+                continue
+            C, labelling = canonical_form(M)
+            index[numpy_adjmatrix_to_g6_bytes(C)] = labelling[permis].astype(np.uint8)
+    return index
+
+
+def seed_words(M, parent_index):
+    """
+    Yields candidate words for G from the permises of its induced subgraphs G - x: for every vertex x such that G - x
+    has a stored permis, the n words made by inserting x at each position of it. Subgraphs are looked up lazily, so a
+    graph solved by its first seeds costs one canonical form.
+    :param M: adjacency matrix of graph G
+    :param parent_index: as returned by parent_permis_index(n - 1)
+    """
+    n = M.shape[0]
+    vertices = np.arange(n, dtype=np.uint8)
+    for x in range(n):
+        keep = np.delete(vertices, x)
+        C, labelling = canonical_form(M[np.ix_(keep, keep)])
+        canonical_permis = parent_index.get(numpy_adjmatrix_to_g6_bytes(C))
+        if canonical_permis is None:
+            # G - x is disconnected, or permisless
+            continue
+        # canonical label -> vertex of G - x -> vertex of G
+        parent_permis = keep[np.argsort(labelling)[canonical_permis]]
+        for position in range(n):
+            yield np.insert(parent_permis, position, x)
+
+
+def find_permis_seeded(M, parent_index, engine=ENGINE_BITSLICED, killer_cache=KILLER_CACHE_SIZE):
+    """
+    Tries the words of seed_words, which are permises far more often than random words are.
+    :param M: adjacency matrix of graph G
+    :param parent_index: as returned by parent_permis_index(n - 1)
+    :param engine: one of the ENGINE_* constants
+    :param killer_cache: how many recently refuting start statuses to try first on every word
+    :return: (permis, tries), a permis for G or np.zeros(n) if no seed is one, and how many seeds were tried
+    """
+    n = M.shape[0]
+    N = neighbourhood_bitmasks(M)
+    status = np.empty(2 ** n, dtype=np.int64)
+    killers = np.full(killer_cache, -1, dtype=np.int64)
+    tries = 0
+    for word in seed_words(M, parent_index):
+        tries += 1
+        if is_permis_with_killers(M, N, word, engine, status, killers):
+            return word, tries
+    return np.zeros(n, dtype=np.uint8), tries
+
+
+def evaluate_seeding(n, engine=ENGINE_BITSLICED):
+    """
+    Seeds every connected n vertex graph from the table for n - 1 vertices and checks the result against the table for
+    n vertices, printing how many graphs the seeds solve and how many words that takes.
+    """
+    parent_index = parent_permis_index(n - 1)
+    permis_table = load_permis_table(n)
+    with_permis = sum(int(np.count_nonzero(np.any(rows, axis=1))) for _, rows in iter_blocks(permis_table))
+    solved = 0
+    tries_to_solve = 0
+    for _, Ms in Graph6Stack(f"./geng_outputs/graph{n}c.g6").blocks():
+        for M in Ms:
+            permis, tries = find_permis_seeded(M, parent_index, engine)
+            if np.any(permis):
+                solved += 1
+                tries_to_solve += tries
+    print(f"Seeds solved {solved} of {with_permis} {n} vertex graphs with a permis, "
+          f"{tries_to_solve / max(solved, 1):.2f} words tried on average")
+
+
+if __name__ == "__main__":
+    for n in range(4, 10):
+        if permis_table_exists(n):
+            evaluate_seeding(n)
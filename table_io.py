@@ -0,0 +1,399 @@
+import json
+import os
+from time import perf_counter
+
+import numpy as np
+
+from generators import rank_permutations, unrank_permutations
+
+
+class CheckpointedTable:
+    """
+    A results table (e.g. a permis table) filled over a long run, kept on disk as it is filled so a crashed or
+    pre-empted run loses at most the last few seconds of work. Rows are written straight into a memory-mapped .npy
+    next to the final path, and a second .npy of flags records which graph indices are done. The flags are kept in
+    memory and only copied into their memory map every flush_every seconds, once the rows have been synced to disk, so
+    a flag is never on disk before its row: the kernel writes back pages of a shared memory map whenever it likes, so
+    setting the flags in the map straight away would not guarantee that. Opening a table whose checkpoint exists
+    continues it: pending() then only lists the graphs left to do.
+    Once every row is done, finish() moves the table to its final path and removes the flags.
+    """
+
+    def __init__(self, path, num_graphs, row_shape=(), dtype=np.uint8, flush_every=30.0):
+        """
+        :param path: final path of the table, e.g. permis_tables/permises_for_g10c.npy
+        :param num_graphs: number of rows
+        :param row_shape: shape of one row, e.g. (n,) for a permis table
+        :param dtype: dtype of the table
+        :param flush_every: seconds between flushes to disk
+        """
+        self.path = path
+        self.table_path = path + ".part"
+        self.done_path = path + ".done.part"
+        self.flush_every = flush_every
+        shape = (num_graphs,) + tuple(row_shape)
+        if os.path.exists(self.table_path) and os.path.exists(self.done_path):
+            self.table = np.lib.format.open_memmap(self.table_path, mode="r+")
+            self._done_on_disk = np.lib.format.open_memmap(self.done_path, mode="r+")
+            if self.table.shape != shape or self.table.dtype != dtype or self._done_on_disk.shape != (num_graphs,):
+                raise ValueError(f"checkpoint {self.table_path} does not match a table of shape {shape}, {dtype}")
+        else:
+            # the table is written before the flags, so an interrupted creation just starts over
+            self.table = np.lib.format.open_memmap(self.table_path, mode="w+", dtype=dtype, shape=shape)
+            self._done_on_disk = np.lib.format.open_memmap(self.done_path, mode="w+", dtype=np.bool_,
+                                                           shape=(num_graphs,))
+        self.done = np.array(self._done_on_disk)
+        self._unflushed = (num_graphs, 0)  # the range of indices marked done since the last flush
+        self.last_flush = perf_counter()
+
+    def __len__(self):
+        return self.table.shape[0]
+
+    def __setitem__(self, index, value):
+        """
+        Records the result of graph(s) index, an int or a slice, and marks them done.
+        """
+        self.table[index] = value
+        self.mark_done(index)
+
+    def mark_done(self, index):
+        """
+        Marks graph(s) index done, for rows which were written to table_path by another process.
+        """
+        self.done[index] = True
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(len(self))
+        else:
+            start = int(index)
+            stop = start + 1
+        self._unflushed = (min(self._unflushed[0], start), max(self._unflushed[1], stop))
+        self.maybe_flush()
+
+    def num_done(self):
+        return int(np.count_nonzero(self.done))
+
+    def pending(self, start=0, stop=None):
+        """
+        :return: np.array of the indices in start..stop-1 not done yet
+        """
+        return np.flatnonzero(~self.done[start:stop]) + start
+
+    def maybe_flush(self):
+        if perf_counter() - self.last_flush > self.flush_every:
+            self.flush()
+
+    def flush(self):
+        # rows first, synced to disk before the flags for them are even written into their memory map
+        self.table.flush()
+        start, stop = self._unflushed
+        if start < stop:
+            self._done_on_disk[start:stop] = self.done[start:stop]
+            self._done_on_disk.flush()
+        self._unflushed = (len(self), 0)
+        self.last_flush = perf_counter()
+
+    def finish(self):
+        """
+        :return: the finished table, memory-mapped read-only from its final path
+        """
+        if not np.all(self.done):
+            raise ValueError(f"{len(self) - self.num_done()} rows of {self.path} are not done")
+        self.flush()
+        del self.table, self._done_on_disk
+        os.replace(self.table_path, self.path)
+        os.remove(self.done_path)
+        return np.load(self.path, mmap_mode="r")
+
+
+class ShardedTableWriter:
+    """
+    Writes a results table too large for memory as shards of shard_rows rows, in a directory with a manifest.json
+    giving the layout. Rows may arrive in any order; only shards with rows still missing are held in memory, and each
+    is saved (to a temporary name, then renamed) as soon as it is complete. Like CheckpointedTable, opening a writer on
+    an existing directory continues it: the saved shards are done, and a crash loses only the shards still open.
+    """
+
+    def __init__(self, directory, num_rows, row_shape=(), dtype=np.uint8, shard_rows=1 << 20):
+        """
+        :param directory: directory of the table, e.g. permis_tables/permises_for_g11c
+        :param num_rows: number of rows
+        :param row_shape: shape of one row, e.g. (n,) for a permis table
+        :param dtype: dtype of the table
+        :param shard_rows: rows per shard
+        """
+        self.directory = directory
+        self.num_rows = num_rows
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        self.shard_rows = shard_rows
+        self.num_shards = -(-num_rows // shard_rows)
+        manifest = {"num_rows": num_rows, "row_shape": list(self.row_shape), "dtype": self.dtype.str,
+                    "shard_rows": shard_rows}
+        manifest_path = os.path.join(directory, "manifest.json")
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as file:
+                if json.load(file) != manifest:
+                    raise ValueError(f"{directory} holds a table with a different layout")
+        else:
+            with open(manifest_path, "w") as file:
+                json.dump(manifest, file)
+        self._open = {}  # shard number -> (rows, filled flags), for shards not saved yet
+
+    def __len__(self):
+        return self.num_rows
+
+    def _shard_path(self, k):
+        return os.path.join(self.directory, f"shard_{k:05d}.npy")
+
+    def _shard_size(self, k):
+        return min(self.shard_rows, self.num_rows - k * self.shard_rows)
+
+    def shard_done(self, k):
+        return os.path.exists(self._shard_path(k))
+
+    def __setitem__(self, index, value):
+        """
+        Records the result of graph index.
+        """
+        k, r = divmod(int(index), self.shard_rows)
+        if k not in self._open:
+            if self.shard_done(k):
+                return
+            size = self._shard_size(k)
+            self._open[k] = (np.zeros((size,) + self.row_shape, dtype=self.dtype), np.zeros(size, dtype=np.bool_))
+        rows, filled = self._open[k]
+        rows[r] = value
+        filled[r] = True
+        if filled.all():
+            temporary_path = self._shard_path(k) + ".part"
+            with open(temporary_path, "wb") as file:
+                np.save(file, rows)
+            os.replace(temporary_path, self._shard_path(k))
+            del self._open[k]
+
+    def pending(self, start=0, stop=None):
+        """
+        :return: np.array of the indices in start..stop-1 not done yet
+        """
+        stop = self.num_rows if stop is None else min(stop, self.num_rows)
+        pending = []
+        for k in range(start // self.shard_rows, -(-stop // self.shard_rows)):
+            first = k * self.shard_rows
+            lo, hi = max(start, first), min(stop, first + self.shard_rows)
+            if k in self._open:
+                pending.append(np.flatnonzero(~self._open[k][1][lo - first:hi - first]) + lo)
+            elif not self.shard_done(k):
+                pending.append(np.arange(lo, hi))
+        return np.concatenate(pending) if pending else np.zeros(0, dtype=np.int64)
+
+    def num_done(self):
+        saved = sum(self._shard_size(k) for k in range(self.num_shards) if self.shard_done(k))
+        return saved + sum(int(np.count_nonzero(filled)) for _, filled in self._open.values())
+
+    def finish(self):
+        """
+        :return: the finished table, as a ShardedTable
+        """
+        missing = [k for k in range(self.num_shards) if not self.shard_done(k)]
+        if missing:
+            raise ValueError(f"{len(missing)} shards of {self.directory} are not done")
+        return ShardedTable(self.directory)
+
+
+class ShardedTable:
+    """
+    Read-only view of a table written by ShardedTableWriter, indexed like the np.array it stands for; shards are
+    memory-mapped on first access, so reading part of the table only touches the shards it lies in.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "manifest.json")) as file:
+            manifest = json.load(file)
+        self.num_rows = manifest["num_rows"]
+        self.row_shape = tuple(manifest["row_shape"])
+        self.dtype = np.dtype(manifest["dtype"])
+        self.shard_rows = manifest["shard_rows"]
+        self._shards = {}
+
+    def __len__(self):
+        return self.num_rows
+
+    @property
+    def shape(self):
+        return (self.num_rows,) + self.row_shape
+
+    def shard(self, k):
+        if k not in self._shards:
+            self._shards[k] = np.load(os.path.join(self.directory, f"shard_{k:05d}.npy"), mmap_mode="r")
+        return self._shards[k]
+
+    def __getitem__(self, index):
+        """
+        :param index: int, slice or np.array of indices
+        """
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += self.num_rows
+            k, r = divmod(int(index), self.shard_rows)
+            return self.shard(k)[r]
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.num_rows)
+            if step == 1:
+                pieces = [self.shard(k)[max(start - k * self.shard_rows, 0):stop - k * self.shard_rows]
+                          for k in range(start // self.shard_rows, -(-stop // self.shard_rows))]
+                return np.concatenate(pieces) if pieces else np.zeros((0,) + self.row_shape, dtype=self.dtype)
+            index = np.arange(start, stop, step)
+        index = np.asarray(index)
+        out = np.empty(index.shape + self.row_shape, dtype=self.dtype)
+        shards, rows = np.divmod(index, self.shard_rows)
+        for k in np.unique(shards):
+            out[shards == k] = self.shard(k)[rows[shards == k]]
+        return out
+
+    def __iter__(self):
+        for _, block in iter_blocks(self, self.shard_rows):
+            yield from block
+
+
+def load_table(path):
+    """
+    :param path: path of a table, either a ShardedTable directory or a .npy file (whose .npy suffix may be left out)
+    :return: the table, a ShardedTable or a read-only memory-mapped np.array, read lazily in both cases
+    """
+    if os.path.isdir(path):
+        return ShardedTable(path)
+    if not path.endswith(".npy") and os.path.exists(path + ".npy"):
+        path += ".npy"
+    return np.load(path, mmap_mode="r")
+
+
+def table_exists(path):
+    """
+    :return: True if load_table(path) would find a table
+    """
+    return os.path.isdir(path) or os.path.exists(path) or os.path.exists(path + ".npy")
+
+
+def iter_blocks(table, block=1 << 20):
+    """
+    Yields (first, rows) for consecutive blocks of rows of a table (np.array, memmap or ShardedTable), so that whole
+    table reductions need only one block in memory at a time.
+    """
+    for first in range(0, len(table), block):
+        yield first, table[first:first + block]
+
+
+def rank_dtype(n):
+    """
+    :return: the dtype of a rank encoded permis table for n vertex graphs: np.uint32 for n <= 12, np.uint64 for n <= 20
+    """
+    if n <= 12:
+        return np.dtype(np.uint32)
+    if n <= 20:
+        return np.dtype(np.uint64)
+    raise ValueError(f"ranks of permutations of {n} elements do not fit in 64 bits")
+
+
+def permisless_rank(n):
+    """
+    :return: the rank which marks a permisless graph in a rank encoded table, the largest value of rank_dtype(n)
+    """
+    return np.iinfo(rank_dtype(n)).max
+
+
+def encode_permises(permises):
+    """
+    Rank encodes rows of a permis table: each permis becomes its lexicographic rank (see rank_permutation), 2-3 times
+    smaller than the word for n = 9..11 and compared with one integer comparison. All-zero rows, which are not
+    permutations for n > 1, become permisless_rank(n).
+    :param permises: np.array of shape (k, n) of permises, all-zero rows for permisless graphs
+    :return: np.array of k ranks of dtype rank_dtype(n)
+    """
+    n = permises.shape[1]
+    ranks = rank_permutations(permises).astype(rank_dtype(n))
+    if n > 1:
+        ranks[~np.any(permises, axis=1)] = permisless_rank(n)
+    return ranks
+
+
+def decode_permises(ranks, n):
+    """
+    :param ranks: np.array of ranks, as returned by encode_permises
+    :param n: number of vertices
+    :return: np.array of shape (k, n) of permises, all-zero rows for permisless graphs
+    """
+    ranks = np.asarray(ranks)
+    permisless = ranks == permisless_rank(n)
+    permises = unrank_permutations(np.where(permisless, 0, ranks), n)
+    permises[permisless] = 0
+    return permises
+
+
+class RankedPermisTable:
+    """
+    A rank encoded permis table (np.array, memmap or ShardedTable of ranks) indexed like the permis table it encodes:
+    rows are decoded on access.
+    """
+
+    def __init__(self, ranks, n):
+        self.ranks = ranks
+        self.n = n
+
+    def __len__(self):
+        return len(self.ranks)
+
+    @property
+    def shape(self):
+        return len(self), self.n
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return decode_permises(np.array([self.ranks[index]]), self.n)[0]
+        return decode_permises(self.ranks[index], self.n)
+
+    def __iter__(self):
+        for _, block in iter_blocks(self):
+            yield from block
+
+
+def load_permis_table(n):
+    """
+    :param n: number of vertices
+    :return: the permis table for the connected n vertex graphs, permis_tables/permises_for_g{n}c, or else its rank
+     encoded form permis_tables/permis_ranks_for_g{n}c as a RankedPermisTable; both read lazily
+    """
+    if table_exists(f"permis_tables/permises_for_g{n}c"):
+        return load_table(f"permis_tables/permises_for_g{n}c")
+    return RankedPermisTable(load_table(f"permis_tables/permis_ranks_for_g{n}c"), n)
+
+
+def permis_table_exists(n):
+    return table_exists(f"permis_tables/permises_for_g{n}c") or table_exists(f"permis_tables/permis_ranks_for_g{n}c")
+
+
+def permisless_indices(permises):
+    """
+    :param permises: a permis table (see load_permis_table)
+    :return: np.array of the indices of the graphs it has as permisless
+    """
+    return np.concatenate([np.flatnonzero(~np.any(rows, axis=1)) + first for first, rows in iter_blocks(permises)])
+
+
+def rank_encode_permis_table(n, block=1 << 20):
+    """
+    Writes permis_tables/permis_ranks_for_g{n}c.npy, the rank encoded form of the permis table for n vertex graphs.
+    """
+    permises = load_table(f"permis_tables/permises_for_g{n}c")
+    ranks = np.lib.format.open_memmap(f"permis_tables/permis_ranks_for_g{n}c.npy", mode="w+", dtype=rank_dtype(n),
+                                      shape=(len(permises),))
+    for first, rows in iter_blocks(permises, block):
+        ranks[first:first + len(rows)] = encode_permises(rows)
+    ranks.flush()
+
+
+if __name__ == "__main__":
+    for n in range(3, 21):
+        if table_exists(f"permis_tables/permises_for_g{n}c"):
+            rank_encode_permis_table(n)
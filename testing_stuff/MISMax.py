@@ -1,9 +1,15 @@
+import os
+import sys
 from time import time
 import networkx as nx
 import numpy as np
 from matplotlib import pyplot as plt
 from numba import jit
 
+# the permis cache lives in the repository root, shared with the other scripts
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from permis_cache import open_cache
+
 
 def numpy_bitstrings(n):
     out_arr = np.zeros((2 ** n, n), dtype=np.uint8)
@@ -93,6 +99,8 @@ def lex_less(x, y):
 
 def main():
     start = time()
+    # graphs past permis_cache.MAX_CACHED_VERTICES are not cached: lookup misses and store does nothing
+    cache = open_cache()
     for n in range(11, 100, 2):
         print("Computing augmented cycles with n=", n)
         Cn = nx.cycle_graph(n)
@@ -112,7 +120,13 @@ def main():
             for i in range(n):
                 if bitstring[i]:
                     G.add_edge(i, n)
-            G_good, witness = is_good_adj_matrix(nx.to_numpy_array(G))
+            M = nx.to_numpy_array(G, dtype=np.uint8)
+            cached = cache.lookup(M)
+            if cached is not None and (cached.permis is not None or not cached.has_permis):
+                G_good, witness = bool(cached.has_permis), cached.permis
+            else:
+                G_good, witness = is_good_adj_matrix(M)
+                cache.store(M, G_good, witness)
 
             if G_good:
                 plt.title("With bitstring %s G was good\n with witness %s" % (bitstring, witness))
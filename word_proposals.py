@@ -0,0 +1,359 @@
+import os
+
+import numpy as np
+from numba import njit
+
+from g6_reader import Graph6Stack
+from generators import ehrlich_star_transpositions
+from permis import ENGINE_BITSLICED, KILLER_CACHE_SIZE, neighbourhood_bitmasks, refuting_state_with, \
+    is_permis_with_killers, find_permis
+from table_io import load_permis_table, iter_blocks
+
+# columns of vertex_features, the inputs of the position model
+VERTEX_FEATURES = ("bias", "degree", "mean_neighbour_degree", "triangles", "in_greedy_mis", "bfs_depth")
+
+
+@njit
+def _degrees(N):
+    n = N.shape[0]
+    degrees = np.zeros(n, dtype=np.int64)
+    for v in range(n):
+        for u in range(n):
+            degrees[v] += (N[v] >> u) & 1
+    return degrees
+
+
+@njit
+def greedy_mis(N):
+    """
+    :return: bitmask of the maximal independent set built by repeatedly taking a vertex of least degree (least label on
+     ties) among those not yet taken or dominated
+    """
+    n = N.shape[0]
+    degrees = _degrees(N)
+    mis = 0
+    free = (1 << n) - 1
+    while free:
+        best = -1
+        for v in range(n):
+            if (free >> v) & 1 and (best < 0 or degrees[v] < degrees[best]):
+                best = v
+        mis |= 1 << best
+        free &= ~(N[best] | (1 << best))
+    return mis
+
+
+@njit
+def _traversal_order(N, root, depth_first):
+    n = N.shape[0]
+    order = np.empty(n, dtype=np.uint8)
+    pending = np.empty(n, dtype=np.int64)
+    pending[0] = root
+    seen = 1 << root
+    head = 0
+    tail = 1
+    k = 0
+    while k < n:
+        if depth_first:
+            tail -= 1
+            v = pending[tail]
+        else:
+            v = pending[head]
+            head += 1
+        order[k] = v
+        k += 1
+        for u in range(n - 1, -1, -1) if depth_first else range(n):
+            if (N[v] >> u) & 1 and not (seen >> u) & 1:
+                seen |= 1 << u
+                pending[tail] = u
+                tail += 1
+    return order
+
+
+@njit
+def bfs_order(N, root):
+    """
+    :return: the vertices of the connected graph G in breadth first order from root, neighbours by label
+    """
+    return _traversal_order(N, root, False)
+
+
+@njit
+def dfs_order(N, root):
+    """
+    :return: the vertices of the connected graph G in (preorder) depth first order from root, neighbours by label
+    """
+    return _traversal_order(N, root, True)
+
+
+@njit
+def vertex_features(N):
+    """
+    :param N: neighbourhood bitmasks of a connected graph G
+    :return: np.array of shape (n, len(VERTEX_FEATURES)), scaled to [0, 1]: a constant, the degree, the mean degree of
+     the neighbours, the number of triangles through the vertex, membership of greedy_mis, and the BFS depth from a
+     vertex of largest degree
+    """
+    n = N.shape[0]
+    scale = max(n - 1, 1)
+    degrees = _degrees(N)
+    mis = greedy_mis(N)
+    root = np.argmax(degrees)
+    depth = np.zeros(n, dtype=np.int64)
+    seen = 1 << root
+    frontier = seen
+    d = 0
+    while frontier:
+        reached = 0
+        for v in range(n):
+            if (frontier >> v) & 1:
+                depth[v] = d
+                reached |= N[v]
+        frontier = reached & ~seen
+        seen |= frontier
+        d += 1
+    X = np.zeros((n, len(VERTEX_FEATURES)), dtype=np.float64)
+    for v in range(n):
+        neighbour_degrees = 0
+        triangles = 0
+        for u in range(n):
+            if (N[v] >> u) & 1:
+                neighbour_degrees += degrees[u]
+                for w in range(u + 1, n):
+                    triangles += (N[v] >> w) & (N[u] >> w) & 1
+        X[v, 0] = 1.0
+        X[v, 1] = degrees[v] / scale
+        X[v, 2] = neighbour_degrees / max(degrees[v], 1) / scale
+        X[v, 3] = triangles / max(scale * (scale - 1) / 2, 1)
+        X[v, 4] = (mis >> v) & 1
+        X[v, 5] = depth[v] / scale
+    return X
+
+
+@njit
+def heuristic_words(N):
+    """
+    :param N: neighbourhood bitmasks of a connected graph G
+    :return: np.array of shape (k, n), distinct words built from the structure of G, in the order they should be tried:
+     the identity, degree orders, BFS and DFS orders from a vertex of least and of largest degree, and the vertices of
+     greedy_mis before, then after, the rest
+    """
+    n = N.shape[0]
+    degrees = _degrees(N)
+    words = np.empty((9, n), dtype=np.uint8)
+    words[0] = np.arange(n)
+    words[1] = np.argsort(degrees, kind="mergesort")
+    words[2] = words[1][::-1]
+    low = np.argmin(degrees)
+    high = np.argmax(degrees)
+    words[3] = bfs_order(N, low)
+    words[4] = bfs_order(N, high)
+    words[5] = dfs_order(N, low)
+    words[6] = dfs_order(N, high)
+    mis = greedy_mis(N)
+    in_mis = np.zeros(n, dtype=np.int64)
+    for v in range(n):
+        in_mis[v] = (mis >> v) & 1
+    words[7] = np.argsort(-in_mis, kind="mergesort")
+    words[8] = np.argsort(in_mis, kind="mergesort")
+    # keep the first occurrence of each word
+    keep = np.ones(words.shape[0], dtype=np.bool_)
+    for i in range(words.shape[0]):
+        for j in range(i):
+            if keep[j] and np.all(words[i] == words[j]):
+                keep[i] = False
+                break
+    return words[keep]
+
+
+@njit
+def model_words(N, weights, noise, temperature=2.0):
+    """
+    Words from the position model: vertices sorted by the position weights predict for them (see fit_position_model),
+    then the same with Gumbel noise of growing scale added to the predictions, so the words drift from the prediction
+    towards uniformly random ones.
+    :param N: neighbourhood bitmasks of a connected graph G
+    :param weights: np.array of len(VERTEX_FEATURES) floats
+    :param noise: np.array of shape (count, n) of standard Gumbel draws, one row per word to make
+    :param temperature: scale of the noise at the last word
+    :return: np.array of shape (count, n)
+    """
+    count, n = noise.shape
+    X = vertex_features(N)
+    predicted = np.zeros(n)
+    for f in range(X.shape[1]):
+        predicted += X[:, f] * weights[f]
+    words = np.empty((count, n), dtype=np.uint8)
+    for i in range(count):
+        scale = temperature * i / max(count - 1, 1)
+        words[i] = np.argsort(predicted + scale * noise[i])
+    return words
+
+
+def proposed_words(M, weights=None, count=1 << 10, rng=None):
+    """
+    :param M: adjacency matrix of graph G
+    :param weights: position model weights (see fit_position_model), or None for the structural heuristics only
+    :param count: how many model words to add after the heuristic ones
+    :param rng: np.random.Generator for the noise of the model words, np.random.default_rng(0) if None
+    :return: np.array of shape (k, n), the words to try, most promising first
+    """
+    N = neighbourhood_bitmasks(M)
+    words = heuristic_words(N)
+    if weights is None:
+        return words
+    if rng is None:
+        rng = np.random.default_rng(0)
+    return np.concatenate([words, model_words(N, weights, rng.gumbel(size=(count, N.shape[0])))])
+
+
+def fit_position_model(n, max_graphs=1 << 15, seed=0):
+    """
+    Mines the permis table for n vertex graphs: a least squares fit of the relative position (0 first, 1 last) of each
+    vertex in the stored permis of its graph against its vertex_features.
+    :param n: number of vertices; the permis table must exist (see load_permis_table)
+    :param max_graphs: fit on at most this many graphs with a permis, chosen at random
+    :return: np.array of len(VERTEX_FEATURES) weights
+    """
+    stack = Graph6Stack(f"./geng_outputs/graph{n}c.g6")
+    with_permis = np.concatenate([np.flatnonzero(np.any(rows, axis=1)) + first
+                                  for first, rows in iter_blocks(load_permis_table(n))])
+    rng = np.random.default_rng(seed)
+    if len(with_permis) > max_graphs:
+        with_permis = np.sort(rng.choice(with_permis, max_graphs, replace=False))
+    permises = load_permis_table(n)[with_permis]
+    masks = stack.bitmasks(with_permis).astype(np.int64)
+    X = np.concatenate([vertex_features(N) for N in masks])
+    position = np.empty(permises.shape, dtype=np.float64)
+    position[np.arange(len(permises))[:, None], permises] = np.arange(n) / max(n - 1, 1)
+    weights, *_ = np.linalg.lstsq(X, position.ravel(), rcond=None)
+    return weights
+
+
+def load_position_model(n):
+    """
+    :return: the position model fitted on the permis table for n vertex graphs, from permis_tables/word_model_g{n}c.npy,
+     fitting and saving it first if needed
+    """
+    path = f"permis_tables/word_model_g{n}c.npy"
+    if not os.path.exists(path):
+        np.save(path, fit_position_model(n))
+    return np.load(path)
+
+
+@njit
+def first_permis_among(M, N, words, engine=ENGINE_BITSLICED, killer_cache=KILLER_CACHE_SIZE):
+    """
+    :return: the index of the first of words which is a permis for G, or -1 if none is
+    """
+    status = np.empty(2 ** N.shape[0], dtype=np.int64)
+    killers = np.full(killer_cache, -1, dtype=np.int64)
+    for i in range(words.shape[0]):
+        if is_permis_with_killers(M, N, words[i], engine, status, killers):
+            return i
+    return -1
+
+
+def find_permis_proposed(M, weights=None, engine=ENGINE_BITSLICED, count=1 << 10):
+    """
+    Same as permis.find_permis, but first tries proposed_words, falling back to the exhaustive search.
+    :param M: adjacency matrix of graph G
+    :param weights: position model weights (see load_position_model), or None for the structural heuristics only
+    :param engine: one of the ENGINE_* constants
+    :param count: how many model words to try
+    :return: np.array a permis for graph G if one exists, or np.zeros(n) otherwise
+    """
+    words = proposed_words(M, weights, count)
+    i = first_permis_among(M, neighbourhood_bitmasks(M), words, engine)
+    if i >= 0:
+        return words[i]
+    return find_permis(M, engine)
+
+
+@njit
+def ehrlich_calls_to_first_permis(M, N, engine=ENGINE_BITSLICED):
+    """
+    :return: how many words find_permis checks before and including the first permis, or -1 if G has none
+    """
+    n = N.shape[0]
+    status = np.empty(2 ** n, dtype=np.int64)
+    buffer = np.arange(n, dtype=np.uint8)
+    word = buffer[::-1]
+    calls = 0
+    for _ in ehrlich_star_transpositions(buffer):
+        calls += 1
+        if refuting_state_with(M, N, word, engine, status) < 0:
+            return calls
+    return -1
+
+
+@njit
+def _seed_numba(seed):
+    # numba keeps its own random state, which only a seed call inside compiled code sets
+    np.random.seed(seed)
+
+
+@njit
+def random_calls_to_first_permis(M, N, max_calls, engine=ENGINE_BITSLICED):
+    """
+    :return: how many words find_permis_whp checks before and including the first permis (max_calls if it finds none)
+    """
+    n = N.shape[0]
+    status = np.empty(2 ** n, dtype=np.int64)
+    word = np.arange(n, dtype=np.uint8)
+    for calls in range(1, max_calls + 1):
+        if refuting_state_with(M, N, word, engine, status) < 0:
+            return calls
+        np.random.shuffle(word)
+    return max_calls
+
+
+def evaluate_proposals(n, train_n=None, sample=2000, count=1 << 10, seed=0):
+    """
+    Offline evaluation: over a random sample of the connected n vertex graphs with a permis, the mean number of words
+    checked up to the first permis by the current searches (exhaustive Ehrlich order, and uniformly random words from
+    the identity) and by the proposals (heuristics alone, then heuristics and the model, falling back to Ehrlich order).
+    :param n: number of vertices
+    :param train_n: fit the position model on the table for train_n vertex graphs, n - 1 by default so the graphs
+     evaluated are not in the training data
+    :param sample: how many graphs to evaluate
+    :param count: how many model words to propose
+    """
+    if train_n is None:
+        train_n = n - 1
+    weights = load_position_model(train_n)
+    stack = Graph6Stack(f"./geng_outputs/graph{n}c.g6")
+    with_permis = np.concatenate([np.flatnonzero(np.any(rows, axis=1)) + first
+                                  for first, rows in iter_blocks(load_permis_table(n))])
+    rng = np.random.default_rng(seed)
+    _seed_numba(seed)
+    indices = np.sort(rng.choice(with_permis, min(sample, len(with_permis)), replace=False))
+    calls = {"ehrlich": [], "random": [], "heuristics": [], "heuristics+model": []}
+    hits = {"heuristics": 0, "heuristics+model": 0}
+    for M in stack[indices]:
+        M = M.astype(np.uint8)
+        N = neighbourhood_bitmasks(M)
+        ehrlich = ehrlich_calls_to_first_permis(M, N)
+        calls["ehrlich"].append(ehrlich)
+        calls["random"].append(random_calls_to_first_permis(M, N, 1 << 20))
+        proposals = [("heuristics", proposed_words(M)), ("heuristics+model", proposed_words(M, weights, count, rng))]
+        for name, words in proposals:
+            i = first_permis_among(M, N, words, killer_cache=0)
+            if i >= 0:
+                hits[name] += 1
+                calls[name].append(i + 1)
+            else:
+                calls[name].append(len(words) + ehrlich)
+    print(f"Words checked up to the first permis, mean over {len(indices)} {n} vertex graphs with a permis "
+          f"(model fitted on {train_n} vertex graphs):")
+    for name, values in calls.items():
+        line = f"  {name:>16}: {np.mean(values):8.2f} mean, {np.median(values):6.0f} median, {np.max(values):7d} max"
+        if name in hits:
+            line += f", {hits[name]} found among the proposals"
+        print(line)
+    return {name: np.mean(values) for name, values in calls.items()}
+
+
+if __name__ == "__main__":
+    for n in (8, 9):
+        evaluate_proposals(n)